@@ -0,0 +1 @@
+# ビューアのホットパス計測用ベンチマーク群 (python -m bench.<name> で実行)
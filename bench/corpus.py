@@ -0,0 +1,90 @@
+"""ベンチマーク用の合成 PNG コーパスを作る
+
+Forge 形式の parameters チャンクを持つ PNG と、ComfyUI 形式の prompt (JSON) を持つ PNG を混ぜて生成する。
+画像データは全ファイル共通の小さな IDAT を使い回し、PIL を通さずにチャンクを直接書き出すので 10 万枚でも速い。
+
+使い方:
+    python -m bench.corpus <出力フォルダ> <枚数> [--seed N]
+"""
+import os
+import sys
+import json
+import zlib
+import time
+import struct
+import random
+import argparse
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+WIDTH, HEIGHT = 64, 96
+COMFY_EVERY = 3  # この間隔で ComfyUI 形式のファイルを混ぜる
+
+SUBJECTS = ["1girl", "1boy", "2girls", "solo", "dog", "cat", "landscape", "city", "robot", "dragon"]
+TAGS = ["masterpiece", "best quality", "highres", "long hair", "short hair", "blue eyes", "red eyes", "smile", "looking at viewer",
+        "outdoors", "indoors", "night", "sky", "cloud", "flower", "school uniform", "dress", "hat", "glasses", "from above",
+        "from below", "upper body", "full body", "depth of field", "bokeh", "sunset", "rain", "snow", "forest", "beach"] + [f"tag{i}" for i in range(300)]
+NEGATIVE = ["lowres", "bad anatomy", "bad hands", "text", "error", "missing fingers", "cropped", "worst quality", "jpeg artifacts", "watermark"]
+SAMPLERS = ["Euler a", "Euler", "DPM++ 2M", "DPM++ SDE", "UniPC"]
+MODELS = ["modelA_v1", "modelB_v2", "modelC_xl"]
+
+
+def _chunk(ctype: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + ctype + data + struct.pack(">I", zlib.crc32(ctype + data))
+
+_IHDR = _chunk(b"IHDR", struct.pack(">IIBBBBB", WIDTH, HEIGHT, 8, 2, 0, 0, 0))
+_IDAT = _chunk(b"IDAT", zlib.compress(b"".join(b"\0" + bytes([(y * 4) % 256, 80, 160]) * WIDTH for y in range(HEIGHT))))
+_IEND = _chunk(b"IEND", b"")
+
+def png_bytes(texts: dict) -> bytes:
+    """texts を tEXt チャンク (ASCII 以外を含めば iTXt) として埋め込んだ PNG のバイト列"""
+    chunks = []
+    for key, value in texts.items():
+        try: chunks.append(_chunk(b"tEXt", key.encode("latin-1") + b"\0" + value.encode("latin-1")))
+        except UnicodeEncodeError: chunks.append(_chunk(b"iTXt", key.encode("latin-1") + b"\0\0\0\0\0" + value.encode("utf-8")))
+    return PNG_SIGNATURE + _IHDR + b"".join(chunks) + _IDAT + _IEND
+
+
+def forge_parameters(rng: random.Random, i: int) -> str:
+    prompt = ", ".join([rng.choice(SUBJECTS)] + rng.sample(TAGS, rng.randint(8, 30)))
+    if rng.random() < 0.3: prompt += f", <lora:style{rng.randint(0, 9)}:{rng.choice(['0.6', '0.8', '1.0'])}>"
+    negative = ", ".join(rng.sample(NEGATIVE, rng.randint(3, 8)))
+    return (f"{prompt}\nNegative prompt: {negative}\nSteps: {rng.choice([20, 25, 30])}, Sampler: {rng.choice(SAMPLERS)}, CFG scale: {rng.choice([5, 6, 7])}, "
+            f"Seed: {rng.randint(0, 2**32 - 1)}, Size: {WIDTH}x{HEIGHT}, Model: {rng.choice(MODELS)}, Clip skip: 2")
+
+def comfy_prompt(rng: random.Random, i: int) -> str:
+    prompt = ", ".join([rng.choice(SUBJECTS)] + rng.sample(TAGS, rng.randint(8, 30)))
+    return json.dumps({
+        "3": {"class_type": "KSampler", "inputs": {"seed": rng.randint(0, 2**32 - 1), "steps": 20, "cfg": 7, "sampler_name": "euler", "model": ["4", 0]}},
+        "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": f"{rng.choice(MODELS)}.safetensors"}},
+        "6": {"class_type": "CLIPTextEncode", "inputs": {"text": prompt, "clip": ["4", 1]}},
+        "7": {"class_type": "CLIPTextEncode", "inputs": {"text": ", ".join(rng.sample(NEGATIVE, 4)), "clip": ["4", 1]}},
+    })
+
+
+def make_corpus(folder: str, count: int, seed: int = 0) -> list[str]:
+    """folder に count 枚の PNG を作り、パスのリストを返す (既に同じ枚数があれば作り直さない)。
+    日付順の並びが安定するよう、mtime は 1 秒ずつずらす。"""
+    os.makedirs(folder, exist_ok=True)
+    paths = [os.path.join(folder, f"{i:06d}-{seed}.png") for i in range(count)]
+    if all(os.path.exists(p) for p in paths[-1:] + paths[:1]) and sum(1 for f in os.listdir(folder) if f.endswith(".png")) == count: return paths
+    rng, base_ns = random.Random(seed), time.time_ns() - count * 10**9
+    for i, path in enumerate(paths):
+        texts = {"prompt": comfy_prompt(rng, i)} if i % COMFY_EVERY == COMFY_EVERY - 1 else {"parameters": forge_parameters(rng, i)}
+        with open(path, "wb") as f: f.write(png_bytes(texts))
+        os.utime(path, ns=(base_ns + i * 10**9, base_ns + i * 10**9))
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("folder")
+    parser.add_argument("count", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    start = time.perf_counter(); make_corpus(args.folder, args.count, args.seed)
+    print(f"{args.count} files in {time.perf_counter() - start:.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""Forge API のスタブサーバ (生成パイプラインをオフラインで負荷試験するため)
+
+txt2img には用意しておいた PNG と、リクエストから組み立てた infotexts を返す。応答までの時間 (リクエストごとの固定分 + 1 枚ごとの固定分とステップ数比例分 + ゆらぎ) と、
+503 を返す割合を指定できる。progress / interrupt / sd-models にも応答するので、アプリをそのまま接続して動かすこともできる。
+
+使い方:
+    python -m bench.forge_stub [--port 7860] [--latency 2.0] [--overhead 0.0] [--per-step 0.0] [--jitter 0.0] [--fail-rate 0.0]
+    (アプリ側は PNGVIEWER_FORGE_URL=http://127.0.0.1:7860 を指定して起動する)
+
+テストやベンチマークからは ForgeStub をコンテキストマネージャとして使う (port=0 で空いているポートを使う)。
+"""
+import io
+import sys
+import json
+import time
+import base64
+import random
+import socket
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+MODELS = ["modelA_v1", "modelB_v2", "modelC_xl"]
+
+
+class ForgeStub:
+    def __init__(self, port: int = 0, latency: float = 0.5, per_step: float = 0.0, jitter: float = 0.0, fail_rate: float = 0.0, seed: int = 0, overhead: float = 0.0):
+        self.latency, self.per_step, self.jitter, self.fail_rate, self.overhead = latency, per_step, jitter, fail_rate, overhead
+        self.rng, self.lock, self.images = random.Random(seed), threading.Lock(), {}
+        self.requests, self.interrupted = 0, threading.Event()
+        self.job = None  # 生成中のジョブ (開始時刻, 所要時間)
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler()); self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str: return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="ForgeStub", daemon=True); self.thread.start(); return self
+
+    def stop(self):
+        self.server.shutdown(); self.server.server_close()
+
+    def __enter__(self): return self.start()
+    def __exit__(self, *exc): self.stop()
+
+    def canned_png(self, width: int, height: int) -> str:
+        """サイズごとに 1 度だけ作る PNG (base64)"""
+        with self.lock:
+            if (key := (width, height)) not in self.images:
+                buf = io.BytesIO(); Image.new("RGB", key, (40, 80, 160)).save(buf, "PNG", compress_level=1)
+                self.images[key] = base64.b64encode(buf.getvalue()).decode("ascii")
+            return self.images[key]
+
+    def txt2img(self, payload: dict) -> tuple[int, dict]:
+        with self.lock:
+            self.requests += 1; fail = self.rng.random() < self.fail_rate; count = int(payload.get("batch_size", 1)) * int(payload.get("n_iter", 1))
+            duration = max(0.0, self.overhead + count * (self.latency + self.per_step * int(payload.get("steps", 20))) + self.rng.uniform(-self.jitter, self.jitter))
+            self.job = (time.monotonic(), duration); self.interrupted.clear()
+        self.interrupted.wait(duration)
+        with self.lock: self.job = None
+        if fail: return 503, {"error": "stub failure"}
+        width, height = int(payload.get("width", 512)), int(payload.get("height", 512)); seed = int(payload.get("seed", -1))
+        if seed == -1: seed = self.rng.randint(0, 2**32 - 1)
+        model = payload.get("override_settings", {}).get("sd_model_checkpoint", MODELS[0])
+        infotexts = [f"{payload.get('prompt', '')}\nNegative prompt: {payload.get('negative_prompt', '')}\nSteps: {payload.get('steps', 20)}, Sampler: {payload.get('sampler_name', 'Euler a')}, "
+                     f"CFG scale: {payload.get('cfg_scale', 7)}, Seed: {seed + i}, Size: {width}x{height}, Model: {model}" for i in range(count)]
+        info = {"seed": seed, "all_seeds": [seed + i for i in range(count)], "infotexts": infotexts}
+        return 200, {"images": [self.canned_png(width, height)] * count, "parameters": payload, "info": json.dumps(info)}
+
+    def progress(self) -> dict:
+        with self.lock: job = self.job
+        if job is None: return {"progress": 0.0, "eta_relative": 0.0, "state": {"job_count": 0}}
+        elapsed = time.monotonic() - job[0]
+        return {"progress": min(1.0, elapsed / job[1]) if job[1] else 1.0, "eta_relative": max(0.0, job[1] - elapsed), "state": {"job_count": 1}}
+
+    def _handler(self):
+        stub = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive に対応する
+            def log_message(self, *args): pass
+            def setup(self):
+                super().setup(); self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # ヘッダと本文の書き込みが分かれても遅延させない
+            def reply(self, status: int, body):
+                data = json.dumps(body).encode()
+                self.send_response(status); self.send_header("Content-Type", "application/json"); self.send_header("Content-Length", str(len(data))); self.end_headers()
+                self.wfile.write(data)
+            def do_GET(self):
+                if self.path == "/sdapi/v1/progress": self.reply(200, stub.progress())
+                elif self.path == "/sdapi/v1/sd-models": self.reply(200, [{"title": f"{m}.safetensors", "model_name": m} for m in MODELS])
+                else: self.reply(404, {"detail": "Not Found"})
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path == "/sdapi/v1/txt2img": self.reply(*stub.txt2img(payload))
+                elif self.path == "/sdapi/v1/interrupt": stub.interrupted.set(); self.reply(200, {})
+                else: self.reply(404, {"detail": "Not Found"})
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=7860)
+    parser.add_argument("--latency", type=float, default=2.0, help="txt2img の 1 枚あたりの生成時間 (秒)")
+    parser.add_argument("--overhead", type=float, default=0.0, help="txt2img のリクエストごとにかかる時間 (秒。モデルの準備や VAE などを想定)")
+    parser.add_argument("--per-step", type=float, default=0.0, help="ステップ数 1 あたりに加える時間 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="応答時間のゆらぎ (± 秒)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="txt2img で 503 を返す割合")
+    args = parser.parse_args(argv)
+    stub = ForgeStub(args.port, args.latency, args.per_step, args.jitter, args.fail_rate, overhead=args.overhead)
+    print(f"Forge stub listening on {stub.url}", file=sys.stderr)
+    try: stub.server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally: stub.server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""生成パイプラインの負荷試験 (スタブの Forge サーバに対して GenerationThread を動かし、結果を JSON で出力する)
+
+使い方:
+    python -m bench.generation [--images 20] [--backends 1] [--latency 0.5] [--overhead 0.0] [--batch 4] [--jitter 0.0] [--fail-rate 0.0] [--size 512] [-o result.json]
+
+--backends を 2 以上にすると、応答時間の異なる (latency, latency×2, ...) スタブを並べて、複数の接続先への振り分けを計測する。
+--overhead でリクエストごとにかかる時間を与え、--batch (1 リクエストにまとめる最大枚数) を変えると、まとめて生成する効果を計測できる。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from contextlib import ExitStack
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from bench.forge_stub import ForgeStub
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=20, help="生成する枚数")
+    parser.add_argument("--backends", type=int, default=1, help="スタブサーバの数")
+    parser.add_argument("--latency", type=float, default=0.5, help="スタブの txt2img の 1 枚あたりの生成時間 (秒)")
+    parser.add_argument("--overhead", type=float, default=0.0, help="スタブの txt2img のリクエストごとにかかる時間 (秒)")
+    parser.add_argument("--batch", type=int, help="1 リクエストにまとめる最大枚数 (既定: GENERATION_BATCH_MAX)")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--size", type=int, default=512, help="生成する画像の一辺 (px)")
+    parser.add_argument("-o", "--output", help="結果の JSON の出力先 (既定: 標準出力)")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="pngviewer-genbench-"); cwd = os.getcwd(); os.chdir(work_dir)
+    try:
+        with ExitStack() as stack:
+            stubs = [stack.enter_context(ForgeStub(latency=args.latency * (i + 1), jitter=args.jitter, fail_rate=args.fail_rate, seed=i, overhead=args.overhead)) for i in range(max(1, args.backends))]
+            os.environ["PNGVIEWER_FORGE_BACKENDS"] = ", ".join(stub.url for stub in stubs)  # pngviewer の読み込み前に接続先を差し替える
+            import pngviewer as pv
+            if pv.pyside_refcount_broken(): sys.exit(f"PySide6 {pv.PYSIDE6_VERSION} は参照カウントの不具合で計測中に落ちるので、pip install \"{pv.PYSIDE6_REQUIREMENT}\" で入れ直してください")
+            if args.batch: pv.GENERATION_BATCH_MAX = args.batch
+            from PySide6.QtCore import QCoreApplication
+            app = QCoreApplication.instance() or QCoreApplication([])
+            tasks = [{"prompt": "1girl, masterpiece", "negative_prompt": "lowres", "steps": 20, "seed": i, "width": args.size, "height": args.size} for i in range(args.images)]
+            thread = pv.GenerationThread(tasks, 0, 100.0, "", os.path.join(work_dir, "outputs"), False, True)
+            saved, errors = [], []
+            thread.image_generated.connect(lambda path, *_: saved.append(os.path.basename(path)))
+            thread.error_occurred.connect(errors.append); thread.finished_all.connect(app.quit)
+            start = time.perf_counter(); thread.start(); app.exec(); thread.wait(); elapsed = time.perf_counter() - start
+            # 連番の順に並べた保存ファイルのシードが、タスクの順になっているか (連番は保存の順に振られるので、ファイル名どうしの比較では確かめられない)
+            position = {task["seed"]: i for i, task in enumerate(tasks)}
+            order = [position.get(int(name[:-4].split("-", 1)[1])) for name in sorted(saved)]
+            ordered = None not in order and order == sorted(order) and len(set(order)) == len(order)
+            ideal_per_s = sum(1 / stub.latency for stub in stubs)  # 各スタブがリクエストごとの時間なしで休みなく生成した場合の処理速度
+            report = {"images": len(saved), "requested": args.images, "batch_max": pv.GENERATION_BATCH_MAX, "elapsed_s": round(elapsed, 3), "images_per_s": round(len(saved) / elapsed, 3),
+                      "ideal_images_per_s": round(ideal_per_s, 3), "efficiency": round(len(saved) / elapsed / ideal_per_s, 3),
+                      "ordered": ordered, "errors": errors,
+                      "backends": {backend.name: {"images": thread.backend_stats[backend.name][0], "stub_latency_s": stub.latency, "stub_requests": stub.requests, "client": backend.client.metrics()}
+                                   for backend, stub in zip(pv.GENERATION_BACKENDS, stubs)}}
+    finally:
+        os.chdir(cwd); shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=1)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: f.write(text + "\n")
+    else: print(text)
+    return 0 if ordered else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
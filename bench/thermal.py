@@ -0,0 +1,98 @@
+"""温度スロットルのオフライン検証 (シミュレーションした CPU 温度で ThermalThrottle を動かし、従来の待ち方と比べる)
+
+温度はニュートンの冷却則 (周囲温度へ時定数 tau で近づく) に、生成中だけ発熱を加えたモデルで計算する。
+センサは --sensor-period 秒ごとにしか更新されず、1℃ 単位に丸め、ノイズを加える (実機の LibreHardwareMonitor に合わせる)。
+時間は仮想なので、数時間分の運転が一瞬で終わる。
+
+使い方:
+    python -m bench.thermal [--target 70] [--hours 2] [--generation 8] [--heat 1.5] [--tau 60] [--ambient 35] [--log thermal.csv] [-o result.json]
+
+比べる待ち方:
+    legacy   従来の動作 (1 秒ごとに温度を見て、上限以下になったらすぐ次を生成する)
+    adaptive ThermalThrottle (生成直後の温度が上限に収まる最短の待ち時間を学習する)
+"""
+import os
+import sys
+import json
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from thermal import ThermalThrottle, export_log
+
+STEP = 0.1  # シミュレーションの刻み (秒)
+
+
+class SimulatedMachine:
+    def __init__(self, ambient: float, tau: float, heat: float, sensor_period: float, noise: float, seed: int):
+        self.ambient, self.tau, self.heat, self.sensor_period, self.noise = ambient, tau, heat, sensor_period, noise
+        self.rng, self.now, self.temp, self.reading, self.next_read = random.Random(seed), 0.0, ambient, ambient, 0.0
+        self.samples = []  # (時刻, 真の温度, 生成中か)
+
+    def advance(self, seconds: float, generating: bool):
+        end = self.now + seconds
+        while self.now < end - 1e-9:
+            dt = min(STEP, end - self.now)
+            self.temp += (-(self.temp - self.ambient) / self.tau + (self.heat if generating else 0.0)) * dt; self.now += dt
+            if self.now >= self.next_read: self.reading, self.next_read = float(round(self.temp + self.rng.gauss(0, self.noise))), self.now + self.sensor_period
+            self.samples.append((self.now, self.temp, generating))
+
+    def sensor(self) -> float: return self.reading
+
+
+def run(strategy: str, args) -> tuple[dict, ThermalThrottle | None]:
+    machine = SimulatedMachine(args.ambient, args.tau, args.heat, args.sensor_period, args.noise, args.seed)
+    gen_rng, images, duration = random.Random(args.seed + 1), 0, args.hours * 3600
+    throttle = ThermalThrottle(args.target, args.interval) if strategy == "adaptive" else None
+    first = True
+    while machine.now < duration:
+        waited = 0.0
+        if throttle is not None and not first:
+            waited = throttle.next_delay(machine.sensor(), machine.now); machine.advance(waited, False)
+        while machine.sensor() > args.target or (not first and waited < args.interval):  # 上限を超えたまま生成を始めない (どちらの待ち方でも共通)
+            machine.advance(1.0, False); waited += 1.0
+        if throttle is not None: throttle.start_generation(machine.sensor(), machine.now)
+        machine.advance(max(0.5, args.generation + gen_rng.uniform(-args.generation_jitter, args.generation_jitter)), True)
+        images += 1; first = False
+    settled = [s for s in machine.samples if s[0] >= duration / 4]  # 立ち上がりを除いた後半 3/4
+    over = [t - args.target for _, t, _ in settled if t > args.target]
+    report = {"images": images, "images_per_hour": round(images / args.hours, 1), "mean_temp": round(sum(t for _, t, _ in settled) / len(settled), 2),
+              "max_temp": round(max(t for _, t, _ in settled), 2), "time_over_target": round(len(over) / len(settled), 3),
+              "mean_overshoot": round(sum(over) / len(over), 2) if over else 0.0, "duty_cycle": round(sum(g for *_, g in settled) / len(settled), 3)}
+    if throttle is not None: report.update(learned_heat=throttle.heat, learned_cooling=throttle.cooling and round(throttle.cooling, 4), final_delay_s=round(throttle.delay, 2))
+    return report, throttle
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", type=float, default=70.0, help="上限温度 (℃)")
+    parser.add_argument("--hours", type=float, default=2.0, help="シミュレーションする時間")
+    parser.add_argument("--interval", type=float, default=0.0, help="最小の生成間隔 (秒)")
+    parser.add_argument("--generation", type=float, default=8.0, help="1 枚の生成にかかる時間 (秒)")
+    parser.add_argument("--generation-jitter", type=float, default=1.0)
+    parser.add_argument("--heat", type=float, default=1.5, help="生成中の発熱 (℃/秒)")
+    parser.add_argument("--tau", type=float, default=60.0, help="放熱の時定数 (秒)")
+    parser.add_argument("--ambient", type=float, default=35.0, help="周囲温度 (℃)")
+    parser.add_argument("--sensor-period", type=float, default=2.0, help="センサの更新間隔 (秒)")
+    parser.add_argument("--noise", type=float, default=0.3, help="センサのノイズ (標準偏差 ℃)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log", help="adaptive の制御ログ (CSV) の出力先")
+    parser.add_argument("-o", "--output", help="結果の JSON の出力先 (既定: 標準出力)")
+    args = parser.parse_args(argv)
+
+    report = {}
+    for strategy in ("legacy", "adaptive"):
+        report[strategy], throttle = run(strategy, args)
+        if throttle is not None and args.log: export_log(args.log, [throttle])
+    # 発熱と放熱が釣り合うときの生成の割合 (これより速く生成し続けると上限を超える)
+    report["sustainable_duty_cycle"] = round((args.target - args.ambient) / args.tau / args.heat, 3)
+    text = json.dumps(report, ensure_ascii=False, indent=1)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: f.write(text + "\n")
+    else: print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""ビューアのホットパスのベンチマーク (合成コーパス上で計測し、結果を JSON で出力する)
+
+フォルダ一覧の取得 (get_sorted_image_files)、フィルタ、メタデータの解析、ホイールでの画像切り替え、
+比較表示 (compare_metadata)、コレクションへの追加を、1k / 10k / 100k 枚のコーパスで計測する。
+Qt は QT_QPA_PLATFORM=offscreen で動かすので、ディスプレイの無い環境でも実行できる。
+
+使い方:
+    python -m bench.viewer [--sizes 1000,10000,100000] [-o results.json] [--baseline old.json] [--tolerance 0.25]
+
+--baseline を指定すると、同じコーパス・同じ項目の per_item_ms が tolerance を超えて悪化した項目を報告し、終了コード 1 を返す。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from bench.corpus import make_corpus
+
+SCHEMA_VERSION = 1
+WHEEL_STEPS = 100       # change_image の往復回数
+COMPARE_REPEAT = 50
+COLLECTION_ADD = 1000   # コレクションに追加する枚数の上限
+EXTRACT_SAMPLE = 5000   # extract_png_metadata を計測するファイル数の上限
+TAG_QUERY = "1girl, masterpiece"
+TAG_QUERIES = ["dog | cat, !lowres", "long hair, blue eyes", "tag1*, !1boy"]
+REGEX_QUERY = "re:1girl.*smile"
+
+
+class WheelEvent:
+    """change_image に渡す最小限のホイールイベント (下方向 = 次の画像)"""
+    def __init__(self, step): self.step = step
+    def angleDelta(self):
+        from PySide6.QtCore import QPoint
+        return QPoint(0, 120 if self.step < 0 else -120)
+
+
+class Recorder:
+    def __init__(self): self.results = []
+
+    def add(self, corpus: int, case: str, items: int, seconds: float):
+        self.results.append({"corpus": corpus, "case": case, "items": items, "total_s": round(seconds, 6), "per_item_ms": round(seconds / max(items, 1) * 1e3, 6)})
+        print(f"{corpus:>7} {case:<28} {items:>7} items {seconds * 1e3:11.2f} ms {seconds / max(items, 1) * 1e3:10.4f} ms/item", file=sys.stderr)
+
+    def time(self, corpus: int, case: str, items: int, func, repeat: int = 1):
+        """func を repeat 回実行し、中央値を記録する"""
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter(); func(); samples.append(time.perf_counter() - start)
+        self.add(corpus, case, items, statistics.median(samples))
+
+
+def bench_corpus(pv, app, rec: Recorder, folder: str, paths: list[str], index_dir: str, viewers: list):
+    from pngmeta import MetadataIndex, extract_png_metadata
+    from PySide6.QtCore import QThreadPool
+    n = len(paths)
+    pump = lambda: app.processEvents()
+
+    sample = paths[:EXTRACT_SAMPLE]
+    rec.time(n, "extract_png_metadata", len(sample), lambda: [extract_png_metadata(p) for p in sample])
+
+    # 毎回まっさらなインデックスから始める (前のコーパスの結果を持ち越さない)
+    db_path = os.path.join(index_dir, f"metadata-{n}.db"); pv.METADATA_INDEX = MetadataIndex(db_path)
+    viewer = pv.ImageViewer(); view = viewer.m_view; view.current_folder = folder
+
+    def cold_listing():
+        view.folder_model.set_folder(""); view._filtered_cache.clear(); view.get_sorted_image_files(False)
+    rec.time(n, "sorted_cold", n, cold_listing, repeat=3)
+    rec.time(n, "sorted_warm", n, lambda: view.get_sorted_image_files(False), repeat=20)
+
+    view.text_box.setText(TAG_QUERY)
+    rec.time(n, "filter_cold_index", n, lambda: view.get_sorted_image_files(True))  # 全ファイルの解析と転置インデックスの構築を含む
+    def tag_queries():
+        for q in TAG_QUERIES + [TAG_QUERY]: view.text_box.setText(q); view.get_sorted_image_files(True)
+    rec.time(n, "filter_tag", n * (len(TAG_QUERIES) + 1), tag_queries)
+    rec.time(n, "filter_warm", n, lambda: view.get_sorted_image_files(True), repeat=20)
+    view.text_box.setText(REGEX_QUERY)
+    rec.time(n, "filter_regex", n, lambda: view.get_sorted_image_files(True))
+
+    # アプリの再起動を想定し、SQLite のインデックスを読み直すところから
+    pv.METADATA_INDEX = MetadataIndex(db_path); view._filtered_cache.clear(); view.text_box.setText(TAG_QUERY)
+    rec.time(n, "filter_index_reload", n, lambda: view.get_sorted_image_files(True))
+
+    for case, query in (("change_image", ""), ("change_image_filtered", TAG_QUERY)):
+        view.text_box.setText(query); view.load_image(paths[0]); pump()
+        def wheel():
+            for i in range(WHEEL_STEPS): view.change_image(WheelEvent(1 if i < WHEEL_STEPS // 2 else -1)); pump()
+        rec.time(n, case, WHEEL_STEPS, wheel)
+
+    viewer.l_view.load_image(paths[0]); viewer.r_view.load_image(paths[1 % n])
+    rec.time(n, "compare_metadata", COMPARE_REPEAT, lambda: [viewer.compare_metadata() for _ in range(COMPARE_REPEAT)])
+
+    collection = pv.CollectionWidget(); targets = paths[:COLLECTION_ADD]
+    def add_images():
+        collection.clear_collection()
+        for p in targets: collection.add_image(p)
+    rec.time(n, "collection_add_image", len(targets), add_images, repeat=3)
+
+    QThreadPool.globalInstance().waitForDone(); pump()  # 先読み・サムネイル生成の完了を待ってから次のコーパスへ
+    viewers.append((viewer, collection))  # 破棄は終了時にまとめて行う
+
+
+def git_revision() -> str | None:
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError): return None
+
+
+def compare_with_baseline(results: list[dict], baseline_path: str, tolerance: float) -> list[str]:
+    with open(baseline_path, encoding="utf-8") as f: baseline = {(r["corpus"], r["case"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        if (base := baseline.get((r["corpus"], r["case"]))) and base["per_item_ms"] > 0 and r["per_item_ms"] > base["per_item_ms"] * (1 + tolerance):
+            regressions.append(f"{r['corpus']} {r['case']}: {base['per_item_ms']:.4f} -> {r['per_item_ms']:.4f} ms/item ({r['per_item_ms'] / base['per_item_ms']:.2f}x)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000", help="コーパスの枚数 (カンマ区切り)")
+    parser.add_argument("-o", "--output", help="結果の JSON の出力先 (既定: 標準出力)")
+    parser.add_argument("--corpus-dir", help="コーパスを置くフォルダ (指定すると残して次回も使い回す)")
+    parser.add_argument("--baseline", help="比較する過去の結果 (JSON)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="悪化とみなす割合 (既定: 0.25 = 25%%)")
+    args = parser.parse_args(argv)
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    # pngviewer は import 時にカレントフォルダへ cache/ などを作るので、作業用の一時フォルダへ移ってから読み込む
+    work_dir = tempfile.mkdtemp(prefix="pngviewer-bench-"); corpus_root = os.path.abspath(args.corpus_dir) if args.corpus_dir else os.path.join(work_dir, "corpus")
+    cwd = os.getcwd(); os.chdir(work_dir)
+    try:
+        import pngviewer as pv
+        if pv.pyside_refcount_broken(): sys.exit(f"PySide6 {pv.PYSIDE6_VERSION} は参照カウントの不具合で計測中に落ちるので、pip install \"{pv.PYSIDE6_REQUIREMENT}\" で入れ直してください")
+        import PySide6
+        from PySide6.QtWidgets import QApplication
+        app = QApplication.instance() or QApplication([])
+        rec, viewers = Recorder(), []
+        for n in sizes:
+            start = time.perf_counter(); folder = os.path.join(corpus_root, str(n)); paths = make_corpus(folder, n)
+            print(f"corpus {n}: {time.perf_counter() - start:.1f} s", file=sys.stderr)
+            bench_corpus(pv, app, rec, folder, paths, work_dir, viewers)
+        pv.FilterScanner._executor and pv.FilterScanner._executor.shutdown(cancel_futures=True)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {"schema": SCHEMA_VERSION, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "git": git_revision(), "python": platform.python_version(),
+              "platform": platform.platform(), "pyside6": PySide6.__version__, "cpu_count": os.cpu_count(), "results": rec.results}
+    text = json.dumps(report, ensure_ascii=False, indent=1)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: f.write(text + "\n")
+    else: print(text)
+    if args.baseline and (regressions := compare_with_baseline(rec.results, args.baseline, args.tolerance)):
+        print("regressions:\n  " + "\n  ".join(regressions), file=sys.stderr); return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
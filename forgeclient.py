@@ -0,0 +1,106 @@
+"""Forge (Stable Diffusion WebUI) API のクライアント (Qt に依存しない)
+
+接続はセッションで使い回し (keep-alive)、エンドポイントごとにタイムアウト・リトライ・バックオフを決めておく。
+呼び出しごとの所要時間を記録しておき、metrics() で直近の p50 / p95 などを取り出せる。
+"""
+import time
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# エンドポイント名 -> (パス, メソッド, タイムアウト (接続, 読み込み) 秒, リトライ回数, バックオフの初期値 秒, 冪等か)
+# 冪等でないもの (txt2img / interrupt) は、リクエストが届いていないことが確実な接続エラーのときだけやり直す
+ENDPOINT_POLICIES = {
+    "txt2img":   ("/sdapi/v1/txt2img",   "POST", (3, 300), 2, 1.0, False),
+    "sd-models": ("/sdapi/v1/sd-models", "GET",  (3, 3),   2, 0.5, True),
+    "progress":  ("/sdapi/v1/progress",  "GET",  (1, 1),   0, 0.0, True),  # 毎秒呼ばれるので、失敗しても次の呼び出しに任せる
+    "interrupt": ("/sdapi/v1/interrupt", "POST", (1, 2),   1, 0.2, False),
+}
+RETRY_STATUS = {502, 503, 504}
+POOL_SIZE = 4             # 同時に張っておく接続の数 (生成・進捗確認・中断が重なっても足りる数)
+LATENCY_WINDOW = 256      # p50 / p95 を計算する直近の呼び出し数
+
+
+def _is_connect_error(e: Exception) -> bool:
+    """接続そのものに失敗した (= サーバにリクエストが届いていない) エラーか"""
+    if isinstance(e, requests.ConnectTimeout): return True
+    return isinstance(e, requests.ConnectionError) and isinstance(getattr(e.args[0] if e.args else None, "reason", None), NewConnectionError)
+
+
+class EndpointStats:
+    def __init__(self):
+        self.count = self.errors = self.retries = 0; self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def summary(self) -> dict:
+        lat = sorted(self.latencies); pick = lambda q: round(lat[min(len(lat) - 1, int(len(lat) * q))] * 1e3, 1) if lat else None
+        return {"count": self.count, "errors": self.errors, "retries": self.retries, "p50_ms": pick(0.5), "p95_ms": pick(0.95), "max_ms": round(lat[-1] * 1e3, 1) if lat else None}
+
+
+class ForgeClient:
+    def __init__(self, base_url: str, policies: dict | None = None):
+        self.base_url, self.policies = base_url.rstrip("/"), dict(ENDPOINT_POLICIES, **(policies or {}))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)  # リトライは request() 側で行う
+        self.session.mount("http://", adapter); self.session.mount("https://", adapter)
+        self._lock, self._stats = threading.Lock(), {}
+
+    def request(self, endpoint: str, payload: dict | None = None, retries: int | None = None) -> requests.Response:
+        """endpoint のポリシーに従って呼び出し、成功したレスポンスを返す (失敗時は requests の例外を送出する)。retries を渡すとこの呼び出しだけリトライ回数を変える"""
+        path, method, timeout, policy_retries, backoff, idempotent = self.policies[endpoint]
+        if retries is None: retries = policy_retries
+        stats = self._endpoint_stats(endpoint)
+        for attempt in range(retries + 1):
+            start = time.perf_counter()
+            try:
+                res = self.session.request(method, self.base_url + path, json=payload, timeout=timeout)
+                res.raise_for_status(); self._record(stats, time.perf_counter() - start); return res
+            except requests.RequestException as e:
+                self._record(stats, time.perf_counter() - start, error=True)
+                retryable = isinstance(e, (requests.ConnectionError, requests.Timeout)) or (e.response is not None and e.response.status_code in RETRY_STATUS)
+                if attempt >= retries or not retryable or not (idempotent or _is_connect_error(e)): raise
+                with self._lock: stats.retries += 1
+                time.sleep(backoff * 2 ** attempt)
+
+    def _endpoint_stats(self, endpoint: str) -> EndpointStats:
+        with self._lock:
+            if (stats := self._stats.get(endpoint)) is None: stats = self._stats[endpoint] = EndpointStats()
+            return stats
+
+    def _record(self, stats: EndpointStats, seconds: float, error: bool = False):
+        with self._lock:
+            stats.count += 1; stats.errors += error
+            if not error: stats.latencies.append(seconds)
+
+    def metrics(self) -> dict:
+        with self._lock: return {name: stats.summary() for name, stats in self._stats.items()}
+
+    # --- 各エンドポイント ---
+    def txt2img(self, payload: dict) -> requests.Response: return self.request("txt2img", payload)
+    def sd_models(self, retries: int | None = None) -> list[dict]: return self.request("sd-models", retries=retries).json()
+    def progress(self) -> dict: return self.request("progress").json()
+    def interrupt(self): self.request("interrupt")
+
+    def close(self): self.session.close()
+
+
+# =====================================================================
+# 複数の Forge への振り分け用の接続先
+# =====================================================================
+
+class ForgeBackend:
+    """生成の振り分け先 1 つ分 (model を指定すると、この接続先ではそのモデルに固定して生成する)"""
+    def __init__(self, url: str, model: str = "", client: ForgeClient | None = None):
+        self.url, self.model, self.client = url, model, client or ForgeClient(url)
+        self.name = urlsplit(url).netloc or url
+
+def parse_backends(spec: str) -> list[ForgeBackend]:
+    """"URL[=モデル名], URL[=モデル名], ..." 形式の指定を解釈する"""
+    backends = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        url, _, model = item.partition("=")
+        backends.append(ForgeBackend(url.strip(), model.strip()))
+    return backends
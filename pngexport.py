@@ -0,0 +1,215 @@
+"""PNG メタデータの一括エクスポート (GUI なし)
+
+    python pngviewer.py export <dir> [<dir> ...] [-o 出力先] [--format jsonl|csv|parquet] [--resume]
+
+PySide6 を読み込まずに動作する。フォルダの走査はスレッドで、PNG の解析はプロセスプールで並列に行い、
+結果は見つかった順に書き出す。--resume を付けると出力済みのファイルを飛ばして続きから追記する。
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from pngmeta import scan_files
+
+EXPORT_COLUMNS = ["path", "size", "mtime", "Prompt", "Negative prompt", "Steps", "Sampler", "CFG scale", "Seed", "Size", "Model", "VAE",
+                  "Denoising strength", "Variation seed", "Variation seed strength", "Clip skip", "extra"]  # CSV / Parquet の列 (extra は残りの項目の JSON)
+EXPORT_CHUNK = 256       # 1 回のワーカー呼び出しで解析するファイル数
+WALK_THREADS = 8         # フォルダ走査に使うスレッド数
+PROGRESS_INTERVAL = 1.0  # 進捗 (files/s) を表示する間隔 (秒)
+
+
+# =====================================================================
+# フォルダの並列走査
+# =====================================================================
+
+def _list_dir(path: str, recursive: bool) -> tuple[str, list[str], list[str]]:
+    files, dirs = [], []
+    try:
+        with os.scandir(path) as it:
+            for e in it:
+                try:
+                    if e.name.lower().endswith(".png") and e.is_file(): files.append(e.name)
+                    elif recursive and e.is_dir(follow_symlinks=False): dirs.append(e.path)
+                except OSError: pass
+    except OSError as e: print(f"skip: {path}: {e}", file=sys.stderr)
+    return path, sorted(files), dirs
+
+def walk_png_files(roots: list[str], recursive: bool = True, threads: int = WALK_THREADS):
+    """フォルダをスレッドで並列に走査し、(フォルダ, [ファイル名]) を見つかった順に返す"""
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        pending = {pool.submit(_list_dir, root, recursive) for root in roots}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, files, dirs = future.result()
+                pending |= {pool.submit(_list_dir, d, recursive) for d in dirs}
+                if files: yield path, files
+
+
+# =====================================================================
+# 出力形式 (JSONL / CSV / Parquet)
+# =====================================================================
+
+def make_record(path: str, size: int, mtime_ns: int, meta: dict) -> dict:
+    return {"path": path, "size": size, "mtime": datetime.fromtimestamp(mtime_ns / 1e9).isoformat(timespec="seconds"), **meta}
+
+def flatten_record(record: dict) -> dict:
+    """固定の列に収まらない項目を extra 列 (JSON) にまとめる"""
+    row = {col: record.get(col, "") for col in EXPORT_COLUMNS[:-1]}
+    extra = {k: v for k, v in record.items() if k not in row}
+    row["extra"] = json.dumps(extra, ensure_ascii=False) if extra else ""
+    return row
+
+class JsonlWriter:
+    """1 行 1 レコードの JSON Lines。チャンク単位でまとめて書くので、中断しても行の途中で切れにくい"""
+    def __init__(self, path: str, resume: bool):
+        self.path = path
+        if path == "-": self.f = sys.stdout; return
+        if resume and os.path.exists(path): self._truncate_partial_line()
+        self.f = open(path, "a" if resume else "w", encoding="utf-8", newline="\n")
+
+    def _truncate_partial_line(self):
+        with open(self.path, "rb+") as f:
+            data = f.read(); f.truncate(data.rfind(b"\n") + 1)
+
+    def exported_paths(self) -> set[str]:
+        if self.path == "-" or not os.path.exists(self.path): return set()
+        paths = set()
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try: paths.add(json.loads(line)["path"])
+                except (ValueError, KeyError, TypeError): pass
+        return paths
+
+    def write(self, records: list[dict]):
+        self.f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)); self.f.flush()
+
+    def close(self):
+        if self.f is not sys.stdout: self.f.close()
+
+class CsvWriter(JsonlWriter):
+    def __init__(self, path: str, resume: bool):
+        self.path = path; append = resume and path != "-" and os.path.exists(path) and os.path.getsize(path) > 0
+        if path == "-": self.f = sys.stdout
+        else:
+            if append: self._truncate_partial_line()
+            self.f = open(path, "a" if append else "w", encoding="utf-8", newline="")
+        self.writer = csv.DictWriter(self.f, fieldnames=EXPORT_COLUMNS, lineterminator="\n")
+        if not append: self.writer.writeheader()
+
+    def exported_paths(self) -> set[str]:
+        if self.path == "-" or not os.path.exists(self.path): return set()
+        with open(self.path, encoding="utf-8", newline="") as f: return {row["path"] for row in csv.DictReader(f) if row.get("extra") is not None}
+
+    def write(self, records: list[dict]):
+        self.writer.writerows(flatten_record(r) for r in records); self.f.flush()
+
+class ParquetWriter:
+    """出力先をフォルダとし、実行ごとに part-NNNNN.parquet を追加する (pandas.read_parquet でまとめて読める)"""
+    BATCH = 10000
+
+    def __init__(self, path: str, resume: bool):
+        try: import pyarrow, pyarrow.parquet
+        except ImportError: raise SystemExit("Parquet 出力には pyarrow が必要です (pip install pyarrow)")
+        if path == "-": raise SystemExit("Parquet 出力には -o で出力先フォルダを指定してください")
+        self.pa, self.pq, self.path = pyarrow, pyarrow.parquet, path
+        os.makedirs(path, exist_ok=True)
+        parts = sorted(f for f in os.listdir(path) if f.startswith("part-") and f.endswith(".parquet"))
+        if not resume:
+            for f in parts: os.remove(os.path.join(path, f))
+            parts = []
+        self.parts, self.rows, self.writer = parts, [], None
+        self.schema = pyarrow.schema([(col, pyarrow.int64() if col == "size" else pyarrow.string()) for col in EXPORT_COLUMNS])
+
+    def exported_paths(self) -> set[str]:
+        paths = set()
+        for f in self.parts: paths.update(self.pq.read_table(os.path.join(self.path, f), columns=["path"]).column("path").to_pylist())
+        return paths
+
+    def write(self, records: list[dict]):
+        self.rows += [flatten_record(r) for r in records]
+        if len(self.rows) >= self.BATCH: self._flush()
+
+    def _flush(self):
+        if not self.rows: return
+        if self.writer is None: self.writer = self.pq.ParquetWriter(os.path.join(self.path, f"part-{len(self.parts):05d}.parquet"), self.schema)
+        columns = {col: [str(r[col]) if col != "size" else r[col] for r in self.rows] for col in EXPORT_COLUMNS}
+        self.writer.write_table(self.pa.table(columns, schema=self.schema)); self.rows = []
+
+    def close(self):
+        self._flush()
+        if self.writer is not None: self.writer.close()
+
+WRITERS = {"jsonl": JsonlWriter, "csv": CsvWriter, "parquet": ParquetWriter}
+
+
+# =====================================================================
+# エクスポート本体
+# =====================================================================
+
+class Progress:
+    def __init__(self, quiet: bool = False):
+        self.start = self.last = time.perf_counter(); self.count, self.quiet = 0, quiet
+
+    @property
+    def rate(self) -> float: return self.count / max(time.perf_counter() - self.start, 1e-9)
+
+    def add(self, n: int):
+        self.count += n; now = time.perf_counter()
+        if not self.quiet and now - self.last >= PROGRESS_INTERVAL:
+            self.last = now; print(f"\r{self.count} files  {self.rate:.1f} files/s", end="", file=sys.stderr, flush=True)
+
+def export(roots: list[str], writer, workers: int, recursive: bool = True, skip: set[str] = frozenset(), progress: Progress | None = None) -> int:
+    """roots 以下の PNG を解析して writer に書き出し、書き出した件数を返す"""
+    progress = progress or Progress(quiet=True); futures = {}
+    def drain(return_when):
+        done, _ = wait(futures, return_when=return_when)
+        for future in done:
+            folder = futures.pop(future)
+            records = [make_record(os.path.join(folder, name), size, mtime_ns, meta) for name, size, mtime_ns, meta, _ in future.result()]
+            writer.write(records); progress.add(len(records))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for folder, names in walk_png_files(roots, recursive):
+            if skip: names = [name for name in names if os.path.join(folder, name) not in skip]
+            for i in range(0, len(names), EXPORT_CHUNK):
+                futures[pool.submit(scan_files, folder, names[i:i + EXPORT_CHUNK], None)] = folder
+                if len(futures) >= workers * 4: drain(FIRST_COMPLETED)  # 走査が解析より先に進みすぎないようにする
+        while futures: drain(FIRST_COMPLETED)
+    return progress.count
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="pngviewer.py export", description="PNG に埋め込まれた生成パラメータを一括で書き出します")
+    parser.add_argument("dirs", nargs="+", help="対象フォルダ (既定でサブフォルダも含む)")
+    parser.add_argument("-o", "--output", default="-", help="出力先 (既定: 標準出力。parquet ではフォルダ)")
+    parser.add_argument("-f", "--format", choices=sorted(WRITERS), help="出力形式 (既定: 出力先の拡張子から判断、なければ jsonl)")
+    parser.add_argument("-j", "--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1), help="解析に使うプロセス数")
+    parser.add_argument("--resume", action="store_true", help="出力済みのファイルを飛ばして続きから追記する")
+    parser.add_argument("--no-recursive", dest="recursive", action="store_false", help="サブフォルダを対象にしない")
+    parser.add_argument("-q", "--quiet", action="store_true", help="進捗を表示しない")
+    args = parser.parse_args(argv)
+    fmt = args.format or {".csv": "csv", ".parquet": "parquet"}.get(os.path.splitext(args.output)[1].lower(), "jsonl")
+    if missing := [d for d in args.dirs if not os.path.isdir(d)]: parser.error(f"フォルダが見つかりません: {', '.join(missing)}")
+
+    # spawn で起動されるワーカーが pngviewer.py (PySide6) を読み込み直さないよう、実行中は __main__ をこのモジュールにしておく
+    main_module = sys.modules["__main__"]
+    if getattr(main_module, "__spec__", None) is None: sys.modules["__main__"] = sys.modules[__name__]
+    writer = WRITERS[fmt](args.output, args.resume)
+    try:
+        skip = writer.exported_paths() if args.resume else set()
+        progress = Progress(args.quiet)
+        count = export(args.dirs, writer, max(1, args.workers), args.recursive, skip, progress)
+    except KeyboardInterrupt:
+        print("\n中断しました (--resume で続きから再開できます)", file=sys.stderr); return 130
+    finally:
+        writer.close(); sys.modules["__main__"] = main_module
+    if not args.quiet: print(f"\r{count} files exported ({len(skip)} skipped) in {time.perf_counter() - progress.start:.2f}s, {progress.rate:.1f} files/s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
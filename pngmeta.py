@@ -0,0 +1,454 @@
+import os
+import re
+import json
+import zlib
+import struct
+import sqlite3
+import threading
+from functools import lru_cache
+
+from PIL import Image
+from PIL.PngImagePlugin import PngImageFile
+
+# =====================================================================
+# PNG メタデータの解析 (Qt に依存しない処理群)
+# =====================================================================
+
+def parse_metadata(text: str) -> dict:
+    metadata = {}; neg_prompt_index = text.find("Negative prompt:")
+    if neg_prompt_index == -1: neg_prompt_index = text.find("Steps:")
+    if neg_prompt_index != -1:
+        metadata["Prompt"] = text[:neg_prompt_index].strip(); remaining_text = text[neg_prompt_index:]; steps_index = remaining_text.find("Steps:")
+        metadata["Negative prompt"] = remaining_text[:steps_index].replace("Negative prompt:", "").strip()
+        for param in remaining_text[steps_index:].split(","):
+            if ":" in param: key, value = param.split(":", 1); metadata[key.strip()] = value.strip()
+    return metadata
+
+def extract_comfy_metadata(value: str) -> dict:
+    try:
+        metadata = json.loads(value); prompt, others, prompt_tags, text_id = {}, {}, ["Prompt", "Negative prompt"], 0
+        for values in metadata.values():
+            inputs = values.get("inputs", {})
+            if values.get("class_type") == "CLIPTextEncode":
+                if "text" in inputs and text_id < len(prompt_tags): prompt[prompt_tags[text_id]] = str(inputs["text"]); text_id += 1
+            else:
+                for k, v in inputs.items(): others[k] = str(v)
+        return prompt | others
+    except Exception: return {}
+
+def metadata_from_text(texts: dict) -> dict:
+    for key, value in texts.items():
+        if not isinstance(value, str): continue
+        if key.lower() == 'parameters': return parse_metadata(value)
+        elif key.lower() == 'prompt': return extract_comfy_metadata(value)
+    return {}
+
+def extract_png_metadata_pil(image_path: str) -> dict:
+    """PIL 経由の従来の読み取り (チャンク解析に失敗したファイル用のフォールバック)"""
+    try:
+        with Image.open(image_path) as img:
+            if isinstance(img, PngImageFile): return metadata_from_text(img.info)
+    except Exception: pass
+    return {}
+
+def extract_png_metadata(image_path: str) -> dict:
+    try: return metadata_from_text(read_png_text_chunks(image_path))
+    except PngChunkError: return extract_png_metadata_pil(image_path)
+    except OSError: return {}
+
+
+# =====================================================================
+# PNG チャンクの直接読み取り (画像データには触れない)
+# =====================================================================
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+MAX_TEXT_CHUNK = 8 * 1024 * 1024  # 展開後のテキストサイズ上限 (圧縮爆弾対策)
+
+class PngChunkError(ValueError):
+    """PNG のチャンク構造が壊れている場合に送出する"""
+
+def _inflate(data: bytes) -> bytes:
+    d = zlib.decompressobj()
+    try: out = d.decompress(data, MAX_TEXT_CHUNK)
+    except zlib.error as e: raise PngChunkError(f"zlib: {e}")
+    if d.unconsumed_tail: raise PngChunkError("text chunk too large")
+    return out
+
+def _decode_text_chunk(ctype: bytes, data: bytes) -> tuple[str, str]:
+    keyword, sep, rest = data.partition(b"\0")
+    if not sep or not keyword: raise PngChunkError(f"bad {ctype.decode()} chunk")
+    key = keyword.decode("latin-1")
+    if ctype == b"tEXt": return key, rest.decode("latin-1")
+    if ctype == b"zTXt":
+        if not rest or rest[0] != 0: raise PngChunkError("unknown zTXt compression")
+        return key, _inflate(rest[1:]).decode("latin-1")
+    # iTXt: 圧縮フラグ, 圧縮方式, 言語タグ\0, 翻訳キーワード\0, テキスト (UTF-8)
+    if len(rest) < 2: raise PngChunkError("bad iTXt chunk")
+    comp_flag, comp_method = rest[0], rest[1]
+    _lang, sep1, rest = rest[2:].partition(b"\0"); _tkey, sep2, text = rest.partition(b"\0")
+    if not (sep1 and sep2): raise PngChunkError("bad iTXt chunk")
+    if comp_flag:
+        if comp_method != 0: raise PngChunkError("unknown iTXt compression")
+        text = _inflate(text)
+    return key, text.decode("utf-8", errors="replace")
+
+def read_png_text_chunks(image_path: str, verify_crc: bool = False) -> dict:
+    """最初の IDAT より前にある tEXt / zTXt / iTXt チャンクだけを読み、{キーワード: テキスト} を返す。
+    画像データは読み飛ばし、CRC は verify_crc=True のときだけ検証する。"""
+    texts = {}
+    with open(image_path, "rb") as f:
+        if f.read(8) != PNG_SIGNATURE: raise PngChunkError("not a PNG file")
+        while True:
+            header = f.read(8)
+            if len(header) < 8: raise PngChunkError("truncated chunk header")
+            length, ctype = struct.unpack(">I4s", header)
+            if ctype in (b"IDAT", b"IEND"): break
+            if ctype not in (b"tEXt", b"zTXt", b"iTXt"):
+                f.seek(length + 4, os.SEEK_CUR); continue
+            data, crc = f.read(length), f.read(4)
+            if len(data) < length or len(crc) < 4: raise PngChunkError("truncated chunk")
+            if verify_crc and zlib.crc32(ctype + data) != struct.unpack(">I", crc)[0]: raise PngChunkError(f"CRC mismatch in {ctype.decode()}")
+            key, value = _decode_text_chunk(ctype, data)
+            texts[key] = value
+    return texts
+
+def _make_chunk(ctype: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + ctype + data + struct.pack(">I", zlib.crc32(ctype + data))
+
+def _text_chunk(key: str, value: str) -> bytes:
+    """Latin-1 で表せるテキストは tEXt、それ以外は (PIL と同じく) 非圧縮の iTXt にする"""
+    try: return _make_chunk(b"tEXt", key.encode("latin-1") + b"\0" + value.encode("latin-1"))
+    except UnicodeEncodeError: return _make_chunk(b"iTXt", key.encode("latin-1") + b"\0\0\0\0\0" + value.encode("utf-8"))
+
+def splice_png_text(data: bytes, texts: dict) -> bytes:
+    """PNG のバイト列の最初の IDAT の直前に texts をテキストチャンクとして差し込む (同じキーワードの既存のテキストチャンクは取り除く)。
+    画像データは展開も再圧縮もせず、チャンクを並べ直すだけ。PNG として読めなければ PngChunkError を送出する。"""
+    if not data.startswith(PNG_SIGNATURE): raise PngChunkError("not a PNG file")
+    view, keys = memoryview(data), {key.encode("latin-1") for key in texts}
+    out, pos, inserted = [PNG_SIGNATURE], len(PNG_SIGNATURE), False
+    while True:
+        if pos + 8 > len(data): raise PngChunkError("truncated chunk header")
+        length, ctype = struct.unpack_from(">I4s", data, pos); end = pos + 12 + length
+        if end > len(data): raise PngChunkError("truncated chunk")
+        if ctype in (b"tEXt", b"zTXt", b"iTXt") and bytes(view[pos + 8:pos + 8 + min(length, 80)]).partition(b"\0")[0] in keys: pos = end; continue
+        if not inserted and ctype in (b"IDAT", b"IEND"): out += [_text_chunk(key, value) for key, value in texts.items()]; inserted = True
+        out.append(view[pos:end]); pos = end
+        if ctype == b"IEND": return b"".join(out)
+
+
+# =====================================================================
+# プロンプトタグの転置インデックスとフィルタクエリ
+# =====================================================================
+
+TAG_FIELDS = ("Prompt", "Negative prompt")
+_TAG_SPLIT_RE = re.compile(r",|\n|\bBREAK\b")
+_TAG_WEIGHT_RE = re.compile(r":\s*[-+]?(?:\d+\.?\d*|\.\d+)$")
+_CLOSE_TO_OPEN = {")": "(", "]": "[", "}": "{", ">": "<"}
+_REGEX_CHARS = set("^$.+?\\[]{}")
+
+@lru_cache(maxsize=1 << 16)  # 同じタグは多くのファイルに繰り返し現れる
+def normalize_tag(tag: str) -> str:
+    """表記ゆれを揃える: "(masterpiece:1.2)" -> "masterpiece", "<lora:foo:0.8>" -> "lora:foo", "long_hair" -> "long hair" """
+    tag = tag.strip().lower().lstrip("([{<")
+    # 閉じ括弧は対応する開き括弧が無い分だけ外す ("artist \(style\)" の括弧は残す)
+    while tag and (o := _CLOSE_TO_OPEN.get(tag[-1])) and tag.count(o) < tag.count(tag[-1]): tag = tag[:-1].rstrip()
+    tag = _TAG_WEIGHT_RE.sub("", tag).replace("\\", "").replace("_", " ")
+    return " ".join(tag.split())
+
+def prompt_tags(text: str) -> set[str]:
+    parts = _TAG_SPLIT_RE.split(text) if "BREAK" in text else text.replace("\n", ",").split(",")
+    return {tag for tag in map(normalize_tag, parts) if tag}
+
+class FilterQuery:
+    """フィルタ欄の文字列を解釈したもの。先頭の "-" は対象をネガティブプロンプトに切り替える。
+    既定はタグ検索で、"," / "&" が AND、"|" が OR、"!" が NOT、末尾の "*" が前方一致、"neg:" がネガティブ側のタグ。
+    "re:" で始まるか正規表現の記号を含む場合は従来どおりプロンプト全体を正規表現で検索する。"""
+
+    def __init__(self, text: str):
+        self.text = text.strip(); self.is_neg = self.text.startswith("-")
+        body = self.text[1:].strip() if self.is_neg else self.text
+        self.target_key = "Negative prompt" if self.is_neg else "Prompt"
+        self.regex, self.clauses, self.highlight_words = None, [], []  # clauses: [(含むタグ, 除外するタグ)] の OR
+        if body.startswith("re:") or _REGEX_CHARS & set(re.sub(r":\s*[-+]?\d*\.\d+", "", body)):
+            pattern = body.removeprefix("re:").strip(); self.regex = re.compile(pattern, re.IGNORECASE) if pattern else None
+            self.highlight_words = [pattern]; return
+        for clause in re.split(r"\||\bOR\b", body):
+            pos, neg = [], []
+            for term in re.split(r",|&|\bAND\b", clause):
+                term = term.strip(); excluded = term.startswith("!") or term.startswith("NOT ")
+                term = term.removeprefix("!").removeprefix("NOT ").strip()
+                field = "Negative prompt" if term.lower().startswith("neg:") else self.target_key
+                raw = term[4:].strip() if term.lower().startswith("neg:") else term; prefix = raw.endswith("*")
+                if not (tag := normalize_tag(raw.rstrip("*"))): continue
+                (neg if excluded else pos).append((field, tag, prefix))
+                if not excluded and field == self.target_key: self.highlight_words.append(raw.rstrip("*"))
+            if pos or neg: self.clauses.append((pos, neg))
+
+    @classmethod
+    def parse(cls, text: str):
+        """空や不正なクエリなら None を返す"""
+        try: query = cls(text)
+        except re.error: return None
+        return query if query.regex is not None or query.clauses else None
+
+    @property
+    def is_tag_query(self) -> bool: return self.regex is None
+
+    def matches(self, meta: dict) -> bool:
+        """単一ファイルのメタデータに対して評価する (インデックスを使わない経路用)"""
+        if self.regex is not None: return bool(self.regex.search(meta.get(self.target_key, "")))
+        tags = {field: prompt_tags(meta.get(field, "")) for field in TAG_FIELDS}
+        has = lambda field, tag, prefix: any(t.startswith(tag) for t in tags[field]) if prefix else tag in tags[field]
+        return any(all(has(*t) for t in pos) and not any(has(*t) for t in neg) for pos, neg in self.clauses)
+
+
+class TagPostings:
+    """1 フォルダ分の転置インデックス。ファイルに整数 ID を振り、フィールドごとに {タグ: ID の集合} を持つ"""
+
+    def __init__(self):
+        self.names, self.ids, self.file_tags = [], {}, {}
+        self.postings = {field: {} for field in TAG_FIELDS}
+
+    def add(self, name: str, meta: dict):
+        self.remove(name)
+        if (fid := self.ids.get(name)) is None: fid = self.ids[name] = len(self.names); self.names.append(name)
+        self.file_tags[fid] = file_tags = [prompt_tags(meta.get(field, "")) for field in TAG_FIELDS]
+        for field, tags in zip(TAG_FIELDS, file_tags):
+            postings = self.postings[field]
+            for tag in tags:
+                if (ids := postings.get(tag)) is None: postings[tag] = {fid}
+                else: ids.add(fid)
+
+    def remove(self, name: str):
+        if (fid := self.ids.get(name)) is None or (file_tags := self.file_tags.pop(fid, None)) is None: return
+        for field, tags in zip(TAG_FIELDS, file_tags):
+            postings = self.postings[field]
+            for tag in tags:
+                ids = postings[tag]; ids.discard(fid)
+                if not ids: del postings[tag]
+
+    def lookup(self, field: str, tag: str, prefix: bool = False) -> set[int]:
+        if not prefix: return self.postings[field].get(tag, set())
+        return set().union(*(ids for t, ids in self.postings[field].items() if t.startswith(tag)))
+
+    def search(self, query: FilterQuery) -> set[str]:
+        """AND は小さいポスティングリストから順に積集合、NOT は差集合、OR は和集合で求める"""
+        hits = set()
+        for pos, neg in query.clauses:
+            lists = sorted((self.lookup(*t) for t in pos), key=len)
+            ids = lists[0].intersection(*lists[1:]) if lists else set(self.file_tags)
+            for t in neg:
+                if not ids: break
+                ids -= self.lookup(*t)
+            hits |= ids
+        return {self.names[fid] for fid in hits}
+
+
+# =====================================================================
+# 永続メタデータインデックス (SQLite)
+# =====================================================================
+
+class MetadataIndex:
+    """(path, size, mtime) をキーに解析済みメタデータを保持する SQLite インデックス。
+    フォルダ単位で一度だけ解析し、以降は変更のあったファイルだけを差分更新する。"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._memo = {}  # folder -> {name: (size, mtime_ns, meta)}
+        self._tags = {}  # folder -> TagPostings (タグ検索されたフォルダだけ作る)
+        self.version = 0  # 内容が更新されるたびに増える (フィルタ結果のキャッシュ判定用)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 の接続はスレッドをまたげないため、スレッドごとに接続を持つ
+        if (conn := getattr(self._local, "conn", None)) is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL"); conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS png_meta (path TEXT PRIMARY KEY, folder TEXT NOT NULL, name TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, meta TEXT NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_png_meta_folder ON png_meta (folder)")
+            conn.commit(); self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def folder_key(folder: str) -> str: return os.path.normcase(os.path.abspath(folder))
+
+    def _load_folder(self, key: str) -> dict:
+        with self._lock:
+            if (cached := self._memo.get(key)) is not None: return cached
+        try: rows = self._conn().execute("SELECT name, size, mtime_ns, meta FROM png_meta WHERE folder = ?", (key,)).fetchall()
+        except sqlite3.Error: rows = []
+        entries = {name: (size, mtime_ns, json.loads(meta)) for name, size, mtime_ns, meta in rows}
+        with self._lock: self._memo[key] = entries
+        return entries
+
+    @staticmethod
+    def _scan_stats(folder: str) -> dict:
+        with os.scandir(folder) as it: return {e.name: e.stat() for e in it if e.name.lower().endswith('.png') and e.is_file()}
+
+    @staticmethod
+    def _group_stats(stats: dict) -> dict:
+        """{相対パス: stat} をサブフォルダごとの {ファイル名: stat} に分ける (ライブラリ表示では名前がサブフォルダを含む)"""
+        if not any(os.sep in name for name in stats): return {"": stats}
+        groups = {}
+        for name, st in stats.items(): sub, _, base = name.rpartition(os.sep); groups.setdefault(sub, {})[base] = st
+        return groups
+
+    def folder_metadata(self, folder: str, stats: dict | None = None, parse: bool = True) -> dict:
+        """フォルダ内の全 PNG の {ファイル名: メタデータ} を返す。
+        キャッシュ済みで (size, mtime) が一致するファイルは PNG を開かずに済ませる。
+        parse=False なら未解析のファイルは結果に含めない (並列スキャン中の部分結果用)。
+        stats の名前がサブフォルダを含む場合は、サブフォルダごとのインデックスをまとめて引く。"""
+        if not folder or not os.path.isdir(folder): return {}
+        if stats is None: stats = self._scan_stats(folder)
+        result = {}
+        for sub, sub_stats in self._group_stats(stats).items():
+            metas = self._folder_metadata(os.path.join(folder, sub), sub_stats, parse)
+            result.update({os.path.join(sub, name): meta for name, meta in metas.items()} if sub else metas)
+        return result
+
+    def _folder_metadata(self, folder: str, stats: dict, parse: bool) -> dict:
+        key = self.folder_key(folder); entries = self._load_folder(key)
+        result, updated = {}, []
+        for name, st in stats.items():
+            cached = entries.get(name)
+            if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns: result[name] = cached[2]; continue
+            if not parse: continue
+            meta = extract_png_metadata(os.path.join(folder, name)); result[name] = meta
+            updated.append((name, st.st_size, st.st_mtime_ns, meta))
+        removed = [name for name in entries if name not in stats]
+        if updated or removed: self._store(key, entries, updated, removed)
+        return result
+
+    def stale_names(self, folder: str, stats: dict | None = None) -> list[str]:
+        """インデックスに無い、または更新されているファイル名の一覧"""
+        if not folder or not os.path.isdir(folder): return []
+        if stats is None: stats = self._scan_stats(folder)
+        stale = []
+        for sub, sub_stats in self._group_stats(stats).items():
+            entries = self._load_folder(self.folder_key(os.path.join(folder, sub)))
+            stale += [os.path.join(sub, name) for name, st in sub_stats.items() if (cached := entries.get(name)) is None or cached[0] != st.st_size or cached[1] != st.st_mtime_ns]
+        return stale
+
+    def update_entries(self, folder: str, results: list[tuple]):
+        """外部 (並列スキャンなど) で解析した (name, size, mtime_ns, meta) をまとめて登録する"""
+        groups = {}
+        for name, *row in results: sub, _, base = name.rpartition(os.sep); groups.setdefault(sub, []).append((base, *row))
+        for sub, rows in groups.items(): key = self.folder_key(os.path.join(folder, sub)); self._store(key, self._load_folder(key), rows, [])
+
+    def get(self, image_path: str) -> dict:
+        """単一ファイルのメタデータを返す (必要なら解析してインデックスに登録する)"""
+        try: st = os.stat(image_path)
+        except OSError: return {}
+        folder, name = os.path.split(image_path); key = self.folder_key(folder)
+        entries = self._load_folder(key)
+        if (cached := entries.get(name)) and cached[0] == st.st_size and cached[1] == st.st_mtime_ns: return cached[2]
+        meta = extract_png_metadata(image_path)
+        self._store(key, entries, [(name, st.st_size, st.st_mtime_ns, meta)], [])
+        return meta
+
+    def matching_names(self, folder: str, query: FilterQuery, stats: dict | None = None, parse: bool = True) -> set[str]:
+        """クエリに一致するファイル名の集合を返す。タグ検索は転置インデックスで、正規表現は全件走査で求める"""
+        if not query.is_tag_query: return {name for name, meta in self.folder_metadata(folder, stats, parse).items() if query.matches(meta)}
+        if not folder or not os.path.isdir(folder): return set()
+        if stats is None: stats = self._scan_stats(folder)
+        names = set()
+        for sub, sub_stats in self._group_stats(stats).items():
+            found = self._search_tags(os.path.join(folder, sub), query, sub_stats, parse)
+            names |= {os.path.join(sub, name) for name in found} if sub else found
+        return names
+
+    def _search_tags(self, folder: str, query: FilterQuery, stats: dict, parse: bool) -> set[str]:
+        metas = self._folder_metadata(folder, stats, parse)
+        key = self.folder_key(folder); entries = self._load_folder(key)
+        with self._lock:
+            if (tags := self._tags.get(key)) is None:
+                tags = self._tags[key] = TagPostings()
+                for name, (_, _, meta) in entries.items(): tags.add(name, meta)
+            names = tags.search(query)
+        return names if parse else names & metas.keys()
+
+    def _store(self, key, entries, updated, removed):
+        with self._lock:
+            self.version += 1; tags = self._tags.get(key)
+            for name, size, mtime_ns, meta in updated:
+                entries[name] = (size, mtime_ns, meta)
+                if tags is not None: tags.add(name, meta)
+            for name in removed:
+                entries.pop(name, None)
+                if tags is not None: tags.remove(name)
+        try:
+            with (conn := self._conn()):
+                conn.executemany("INSERT OR REPLACE INTO png_meta (path, folder, name, size, mtime_ns, meta) VALUES (?, ?, ?, ?, ?, ?)",
+                                 [(os.path.join(key, name), key, name, size, mtime_ns, json.dumps(meta, ensure_ascii=False)) for name, size, mtime_ns, meta in updated])
+                conn.executemany("DELETE FROM png_meta WHERE path = ?", [(os.path.join(key, name),) for name in removed])
+        except sqlite3.Error: pass  # 書き込めなくてもメモリ上のキャッシュで動作を継続する
+
+
+# =====================================================================
+# 生成済みの組み合わせの索引 (出力フォルダの parameters から作る)
+# =====================================================================
+
+_MODEL_HASH_RE = re.compile(r"\s*\[[0-9a-fA-F]+\]$")
+_MODEL_EXTENSIONS = (".safetensors", ".ckpt", ".pt", ".gguf")
+
+def _model_name(name: str) -> str:
+    """"sub/model.safetensors [abcd1234]" (チェックポイントのタイトル) と "model" (infotexts の Model) を同じ名前にそろえる"""
+    name = _MODEL_HASH_RE.sub("", name.strip()).replace("\\", "/").rsplit("/", 1)[-1]
+    stem, ext = os.path.splitext(name)
+    return (stem if ext.lower() in _MODEL_EXTENSIONS else name).lower()
+
+def _cfg_str(value) -> str:
+    try: return f"{float(value):g}"
+    except (TypeError, ValueError): return str(value).strip()
+
+def generation_key(prompt, negative, seed, steps, cfg, sampler, width, height, model="") -> tuple:
+    """(プロンプト, ネガティブ, シード, Steps, CFG, サンプラー, サイズ, モデル) を比較用にそろえたタプル"""
+    return (str(prompt).strip(), str(negative).strip(), str(seed).strip(), str(steps).strip(), _cfg_str(cfg), str(sampler).strip().lower(),
+            f"{str(width).strip()}x{str(height).strip()}", _model_name(model) if model else "")
+
+def payload_generation_key(payload: dict) -> tuple:
+    model = payload.get("override_settings", {}).get("sd_model_checkpoint", "")
+    return generation_key(payload.get("prompt", ""), payload.get("negative_prompt", ""), payload.get("seed", -1), payload.get("steps", 20), payload.get("cfg_scale", 7),
+                          payload.get("sampler_name", ""), payload.get("width", 512), payload.get("height", 512), model)
+
+def metadata_generation_key(meta: dict) -> tuple | None:
+    if "Seed" not in meta or "Steps" not in meta: return None
+    width, _, height = meta.get("Size", "").partition("x")
+    return generation_key(meta.get("Prompt", ""), meta.get("Negative prompt", ""), meta["Seed"], meta["Steps"], meta.get("CFG scale", ""), meta.get("Sampler", ""), width, height, meta.get("Model", ""))
+
+class OutputIndex:
+    """出力フォルダ (日付ごとのサブフォルダを含む) にある画像の生成条件の集合。
+    解析は MetadataIndex に任せるので、2 回目以降は変更のあったファイルしか開かない。
+    モデルを指定しない生成とも照合できるよう、モデルを除いたキーも登録しておく。"""
+
+    def __init__(self, metadata_index: MetadataIndex, root: str):
+        self.keys, self.lock = set(), threading.Lock()
+        for folder, _dirs, files in os.walk(root):
+            if any(f.lower().endswith(".png") for f in files):
+                for meta in metadata_index.folder_metadata(folder).values(): self.add(meta)
+
+    def add(self, meta: dict):
+        if (key := metadata_generation_key(meta)) is None: return
+        with self.lock: self.keys.add(key); self.keys.add(key[:-1] + ("",))
+
+    def __contains__(self, payload: dict) -> bool:
+        key = payload_generation_key(payload)
+        with self.lock: return key in self.keys
+
+
+# =====================================================================
+# 並列スキャン用のワーカー関数 (ProcessPoolExecutor から呼ばれる)
+# =====================================================================
+
+def scan_files(folder: str, names: list[str], query: FilterQuery | None) -> list[tuple]:
+    """names を解析し、(name, size, mtime_ns, meta, 一致したか) のリストを返す"""
+    results = []
+    for name in names:
+        path = os.path.join(folder, name)
+        try: st = os.stat(path)
+        except OSError: continue
+        meta = extract_png_metadata(path)
+        results.append((name, st.st_size, st.st_mtime_ns, meta, bool(query and query.matches(meta))))
+    return results
@@ -1,37 +1,167 @@
 import os
+import sys
+
+if __name__ == '__main__' and sys.argv[1:2] == ["export"]:
+    # ヘッドレスのメタデータ一括エクスポート (PySide6 を読み込まずにすぐ終わらせる)
+    from pngexport import main
+    sys.exit(main(sys.argv[2:]))
+
 import re
 import io
 import json
 import time
 import base64
 import random
-import itertools
+import bisect
+import sqlite3
+import queue
+import threading
+import multiprocessing
+import math
 import requests
 from datetime import datetime, date
 from pathlib import Path
 from PIL import Image, PngImagePlugin
-from PIL.PngImagePlugin import PngImageFile
-from functools import partial
+from functools import partial, wraps
+from collections import OrderedDict, deque
+from contextlib import closing, nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from forgeclient import ForgeBackend, parse_backends
+from thermal import ThermalThrottle, export_log
+from pngmeta import MetadataIndex, FilterQuery, OutputIndex, PngChunkError, parse_metadata, extract_comfy_metadata, scan_files, splice_png_text
 
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QLabel, QSplitter, QPushButton, QTextEdit, QFileDialog, QTabWidget,
-    QScrollArea, QFrame, QLineEdit, QLayout, QDialog, QCheckBox,
+    QScrollArea, QFrame, QLineEdit, QDialog, QCheckBox, QListView, QStyledItemDelegate, QStyle,
     QMenu, QSlider, QComboBox, QListWidget, QListWidgetItem, QMessageBox,
     QGroupBox, QGridLayout, QSpinBox, QDoubleSpinBox, QProgressBar, QWidgetAction
 )
-from PySide6.QtCore import Qt, QSize, QRect, QPoint, Signal, QMimeData, QUrl, QByteArray, QEvent, QThread, QTimer, QMutex, QMutexLocker
+from PySide6.QtCore import Qt, QSize, QPoint, Signal, QMimeData, QUrl, QByteArray, QEvent, QThread, QTimer, QMutex, QMutexLocker, QObject, QFileSystemWatcher, QRunnable, QThreadPool, QBuffer, QIODevice, QAbstractListModel, QModelIndex
 from PySide6.QtGui import (
-    QPixmap, QDragEnterEvent, QDropEvent, QColor, QDrag, QCursor,
+    QPixmap, QImage, QImageReader, QDragEnterEvent, QDropEvent, QColor, QDrag, QCursor,
     QGuiApplication, QFont, QIcon, QAction, QTextCursor,
     QTextCharFormat, QKeySequence, QShortcut
 )
+from PySide6 import __version__ as PYSIDE6_VERSION
 
 COLLECTIONS_DIR = "collections"
 DEFAULT_OUTPUT_DIR = "outputs"
-FORGE_URL = "http://127.0.0.1:7860"
+CACHE_DIR = "cache"
+FORGE_URL = os.environ.get("PNGVIEWER_FORGE_URL", "http://127.0.0.1:7860")  # 接続先の Forge (スタブサーバで試すときは環境変数で差し替える)
+FORGE_BACKENDS = os.environ.get("PNGVIEWER_FORGE_BACKENDS", "")  # 複数の Forge に生成を振り分けるときの接続先 ("URL[=モデル名], ..."。空なら FORGE_URL のみ)
+PREFETCH_COUNT = 3         # ホイール操作時に進行方向へ先読みする画像の枚数
+PREFETCH_BUDGET_MB = 256   # 先読み済み画像に使うメモリの上限 (ビューごと)
+PIXMAP_CACHE_MB = 512      # デコード済み画像キャッシュのメモリ上限 (プロセス全体で共有)
+RESCALE_DEBOUNCE_MS = 150  # リサイズ操作が止まってから高品質な縮小に切り替えるまでの待ち時間
+PARALLEL_SCAN_THRESHOLD = 200  # 未解析のファイルがこの数以上あればフィルタ検索を並列スキャンで行う
+SCAN_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+SCAN_CHUNK = 64
+HARDWARE_MONITOR_URL = "http://localhost:8085/data.json"  # CPU 温度の取得元 (LibreHardwareMonitor の Web サーバ)
+TELEMETRY_PROGRESS_S = 1.0     # 生成中に Forge の進捗を取得する間隔 (秒)
+TELEMETRY_TEMPERATURE_S = 2.0  # CPU 温度を取得する間隔 (秒)
+TELEMETRY_STALE_S = 6.0        # これより古い温度は「取得不可」として扱う (秒)
+SEQUENCE_LOCK_NAME = ".pngviewer-seq.lock"  # 連番を確保するときに出力フォルダ内で使うロックファイル
+PARTIAL_SUFFIX = ".part"   # 書き込み中のファイルに付ける拡張子 (書き終えてから .png に改名するので、ビューアには書きかけのファイルが見えない)
+GENERATION_QUEUE_SIZE = 2  # 保存待ちにできる生成結果の数 (超えると次の生成リクエストを待たせる)
+GENERATION_REORDER_LIMIT = 8  # 複数の接続先のとき、先のタスクの結果が届くのを待って保存できずにいる結果の上限 (超えると新しいタスクを取らない)
+GENERATION_BATCH_MAX = 4   # シードだけが連番で異なる連続したタスクを 1 回のリクエストにまとめる最大枚数 (1 ならまとめない)
+GENERATION_BATCH_SIZE = 1  # まとめた画像のうち同時に生成する枚数 (Forge の batch_size。残りは n_iter で順に生成する。VRAM に余裕があれば増やす)
+TRACE_ENABLED = os.environ.get("PNGVIEWER_TRACE", "") not in ("", "0")  # 起動時から計測する (実行中は Ctrl+Shift+T で切り替え)
+TRACE_MAX_EVENTS = 200000  # 保持するトレースイベントの上限 (古いものから捨てる)
+PYSIDE6_REQUIREMENT = "PySide6<6.12"  # 6.12.0 は Python 3.11 以前で None の参照カウントを壊す (pyside_refcount_broken を参照)
 os.makedirs(COLLECTIONS_DIR, exist_ok=True)
 os.makedirs(DEFAULT_OUTPUT_DIR, exist_ok=True)
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+def pyside_refcount_broken() -> bool:
+    """None を返す Qt のメソッド (parent() や QLayout.itemAt() など) を呼ぶたびに None の参照カウントを減らしすぎる PySide6 か。
+    PySide6 6.12.0 を Python 3.11 以前で使うとこうなり、しばらく使ううちに "deallocating None" で異常終了する"""
+    if sys.version_info >= (3, 12): return False  # 3.12 以降の None は参照カウントが変わらない
+    probe = QObject(); before = sys.getrefcount(None)
+    for _ in range(100): probe.parent()
+    return sys.getrefcount(None) < before - 50
+
+# 解析済みメタデータの永続インデックス (全ビュー・全ウィンドウで共有)
+METADATA_INDEX = MetadataIndex(os.path.join(CACHE_DIR, "metadata.db"))
+# 生成の振り分け先と、モデル一覧・進捗の取得に使う Forge API の呼び出し口 (先頭の接続先。接続を使い回し、生成スレッドと GUI スレッドで共有)
+GENERATION_BACKENDS = parse_backends(FORGE_BACKENDS) or [ForgeBackend(FORGE_URL)]
+FORGE_CLIENT = GENERATION_BACKENDS[0].client
+
+# =====================================================================
+# 処理時間の計測 （区間トレース＋操作ごとの内訳表示）
+# =====================================================================
+
+class _Span:
+    __slots__ = ("tracer", "name", "start", "children")
+    def __init__(self, tracer, name): self.tracer, self.name = tracer, name
+    def __enter__(self):
+        self.start, self.children = time.perf_counter_ns(), 0; self.tracer._stack().append(self); return self
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns(); dur = end - self.start; stack = self.tracer._stack(); stack.pop()
+        self.tracer._record(self.name, self.start, dur, dur - self.children, stack)
+        if stack: stack[-1].children += dur
+        return False
+
+class Tracer:
+    """処理区間の計測。無効なときの span() は共有の何もしないコンテキストを返すだけなので、ほぼコストがかからない。
+    有効なときは区間を Chrome トレース形式のイベントとして貯め、最上位の区間 (= 1 回の操作) ごとに区間名別の自己時間をまとめる。"""
+    _NULL = nullcontext()
+
+    def __init__(self, enabled=TRACE_ENABLED, max_events=TRACE_MAX_EVENTS):
+        self.enabled, self.events, self.last_interaction = enabled, deque(maxlen=max_events), None  # last_interaction: (名前, 所要時間 ns, {区間名: 自己時間 ns})
+        self._local, self._breakdown = threading.local(), {}
+
+    def span(self, name: str): return _Span(self, name) if self.enabled else self._NULL
+
+    def _stack(self) -> list:
+        if (stack := getattr(self._local, "stack", None)) is None: stack = self._local.stack = []
+        return stack
+
+    def _record(self, name, start, dur, self_time, stack):
+        self.events.append((name, start, dur, threading.get_ident()))
+        if threading.current_thread() is not threading.main_thread(): return  # 内訳は GUI スレッドの操作だけを対象にする
+        self._breakdown[name] = self._breakdown.get(name, 0) + self_time
+        if not stack: self.last_interaction, self._breakdown = (name, dur, self._breakdown), {}
+
+    def clear(self): self.events.clear(); self.last_interaction = None
+
+    def export_chrome_trace(self, path: str):
+        """chrome://tracing や Perfetto で読み込める JSON (Trace Event Format) として書き出す"""
+        pid, origin = os.getpid(), min((e[1] for e in self.events), default=0)
+        events = [{"name": name, "cat": "pngviewer", "ph": "X", "ts": (start - origin) / 1000, "dur": dur / 1000, "pid": pid, "tid": tid} for name, start, dur, tid in list(self.events)]
+        events += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": t.ident, "args": {"name": t.name}} for t in threading.enumerate() if t.ident is not None]
+        with open(path, "w", encoding="utf-8") as f: json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+TRACER = Tracer()
+
+def traced(name=None):
+    """メソッド全体を区間として計測するデコレータ (無効時は属性を 1 つ見るだけ)"""
+    def decorator(func):
+        label = name or func.__name__
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled: return func(*args, **kwargs)
+            with _Span(TRACER, label): return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class TraceOverlay(QLabel):
+    """直前の操作の所要時間と、区間ごとの内訳 (自己時間) をウィンドウの左下に重ねて表示する"""
+    def __init__(self, parent):
+        super().__init__(parent); self.shown_interaction = None
+        self.setTextFormat(Qt.TextFormat.PlainText); self.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
+        self.setStyleSheet("background-color: rgba(0, 0, 0, 180); color: #80ff80; font-family: monospace; padding: 4px;")
+        self.timer = QTimer(self); self.timer.setInterval(250); self.timer.timeout.connect(self.refresh); self.hide()
+    def set_active(self, active):
+        if not active: self.timer.stop(); self.hide(); return
+        self.show_message("計測中 (Ctrl+Shift+T で停止 / Ctrl+Shift+E で書き出し)"); self.timer.start()
+    def show_message(self, text): self.setText(text); self.adjustSize(); self.move(8, self.parent().height() - self.height() - 8); self.show(); self.raise_()
+    def refresh(self):
+        if (interaction := TRACER.last_interaction) is None or interaction is self.shown_interaction: return
+        self.shown_interaction = interaction; name, total, stages = interaction
+        lines = [f"{name}: {total / 1e6:.1f} ms"] + [f"  {stage:<24}{ns / 1e6:8.1f} ms" for stage, ns in sorted(stages.items(), key=lambda kv: -kv[1])]
+        self.show_message("\n".join(lines))
 
 # =====================================================================
 # ホイールスクロールによる値変更を無効化したカスタムUI部品
@@ -47,32 +177,225 @@ class NoWheelComboBox(QComboBox):
     def wheelEvent(self, event): event.ignore()
 
 
+# =====================================================================
+# デコード済み画像の共有キャッシュ （全ビュー・全ウィンドウ共通）
+# =====================================================================
+
+class PixmapCache:
+    """(パス, mtime) をキーにデコード済み QPixmap を保持する、バイト数上限付きの LRU キャッシュ。
+    原寸の画像に加えて、表示サイズに縮小した版も (パス, 表示サイズ) ごとに同じ上限の中で保持する。"""
+
+    def __init__(self, budget_mb: int):
+        self.budget = budget_mb * 1024 * 1024
+        self.hits, self.misses, self.evictions, self.total_bytes = 0, 0, 0, 0
+        self._cache = OrderedDict()  # (path, size) -> (mtime_ns, QPixmap, bytes)  size: None なら原寸, (w, h) なら縮小版
+
+    @staticmethod
+    def _mtime(path: str):
+        try: return os.stat(path).st_mtime_ns
+        except OSError: return None
+
+    def lookup(self, path: str, size=None):
+        """キャッシュ済みで、ファイルが更新されていなければその QPixmap を返す (無ければ None)"""
+        if (cached := self._cache.get((path, size))) is not None:
+            if cached[0] == self._mtime(path): self._cache.move_to_end((path, size)); self.hits += 1; return cached[1]
+            self.discard(path, size)
+        self.misses += 1
+        return None
+
+    def put(self, path: str, pixmap: QPixmap, mtime_ns=None, size=None) -> QPixmap:
+        if pixmap.isNull() or (mtime_ns := mtime_ns or self._mtime(path)) is None: return pixmap
+        nbytes = pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+        if nbytes > self.budget: return pixmap
+        self.discard(path, size); self._cache[(path, size)] = (mtime_ns, pixmap, nbytes); self.total_bytes += nbytes
+        while self.total_bytes > self.budget: self.discard(*next(iter(self._cache))); self.evictions += 1
+        return pixmap
+
+    def get(self, path: str) -> QPixmap:
+        """キャッシュから取得し、無ければディスクからデコードして登録する"""
+        if (pixmap := self.lookup(path)) is not None: return pixmap
+        mtime_ns = self._mtime(path)
+        return self.put(path, QPixmap(path), mtime_ns)
+
+    def scaled(self, path: str, width: int, height: int, smooth: bool = True, source: QPixmap | None = None) -> QPixmap:
+        """width x height に収まるよう縮小した画像を返す。
+        smooth=False ならドラッグ中のプレビュー用に高速変換だけ行い、結果は保持しない。"""
+        if smooth and (pixmap := self.lookup(path, (width, height))) is not None: return pixmap
+        if (source := source or self.get(path)).isNull(): return source
+        if not smooth: return source.scaled(width, height, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.FastTransformation)
+        return self.put(path, source.scaled(width, height, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation), size=(width, height))
+
+    def discard(self, path: str, size=None):
+        if (cached := self._cache.pop((path, size), None)) is not None: self.total_bytes -= cached[2]
+
+    def __contains__(self, path: str): return (path, None) in self._cache
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "images": len(self._cache), "bytes": self.total_bytes}
+
+PIXMAP_CACHE = PixmapCache(PIXMAP_CACHE_MB)
+
+
+# =====================================================================
+# サムネイルキャッシュ （ディスクに保存し、ワーカースレッドで非同期に生成）
+# =====================================================================
+
+class _ThumbnailSignals(QObject):
+    ready = Signal(str, int, object)  # path, size, QImage
+
+class _ThumbnailTask(QRunnable):
+    def __init__(self, store, path: str, size: int):
+        super().__init__(); self.store, self.path, self.size = store, path, size
+    def run(self): self.store.signals.ready.emit(self.path, self.size, self.store.load_or_create(self.path, self.size))
+
+class ThumbnailStore(QObject):
+    """(パス, ファイルサイズ, mtime) をキーにサムネイルを SQLite に保存するストア。
+    未作成のものは QImageReader.setScaledSize で縮小デコードし、できあがり次第 thumbnail_ready で通知する。"""
+    thumbnail_ready = Signal(str, int, object)  # path, size, QPixmap
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None: cls._instance = ThumbnailStore(os.path.join(CACHE_DIR, "thumbnails.db"))
+        return cls._instance
+
+    def __init__(self, db_path: str, parent=None):
+        super().__init__(parent)
+        self.db_path, self._inflight = db_path, set()
+        try:
+            with closing(sqlite3.connect(self.db_path)) as conn, conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS thumbnails (path TEXT NOT NULL, size INTEGER NOT NULL, file_size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, data BLOB NOT NULL, PRIMARY KEY (path, size))")
+        except sqlite3.Error: pass
+        self.pool = QThreadPool(self); self.pool.setMaxThreadCount(max(2, QThread.idealThreadCount() // 2))
+        self.signals = _ThumbnailSignals(self); self.signals.ready.connect(self.on_ready)
+
+    def request(self, path: str, size: int):
+        """メモリ上にあればすぐに QPixmap を返す。無ければ生成を予約して None を返す"""
+        if (pixmap := PIXMAP_CACHE.lookup(path, (size, size))) is not None: return pixmap
+        if (path, size) not in self._inflight: self._inflight.add((path, size)); self.pool.start(_ThumbnailTask(self, path, size))
+        return None
+
+    def load_or_create(self, path: str, size: int) -> QImage:
+        """ワーカースレッドから呼ばれる：保存済みなら読み出し、無ければ縮小デコードして保存する"""
+        try: st = os.stat(path)
+        except OSError: return QImage()
+        key = (os.path.abspath(path), size)
+        try:
+            with closing(sqlite3.connect(self.db_path, timeout=10)) as conn:
+                row = conn.execute("SELECT data FROM thumbnails WHERE path = ? AND size = ? AND file_size = ? AND mtime_ns = ?", (*key, st.st_size, st.st_mtime_ns)).fetchone()
+                if row and not (image := QImage.fromData(row[0])).isNull(): return image
+                if (image := self.read_scaled(path, size)).isNull(): return image
+                buf = QBuffer(); buf.open(QIODevice.OpenModeFlag.WriteOnly); image.save(buf, "PNG")
+                with conn: conn.execute("INSERT OR REPLACE INTO thumbnails (path, size, file_size, mtime_ns, data) VALUES (?, ?, ?, ?, ?)", (*key, st.st_size, st.st_mtime_ns, bytes(buf.data())))
+                return image
+        except sqlite3.Error: return self.read_scaled(path, size)
+
+    @staticmethod
+    def read_scaled(path: str, size: int) -> QImage:
+        # 縮小サイズを指定して読むことで、原寸の画像を丸ごと保持せずに済ませる
+        reader = QImageReader(path); reader.setAutoTransform(True)
+        if (src := reader.size()).isValid(): reader.setScaledSize(src.scaled(size, size, Qt.AspectRatioMode.KeepAspectRatio))
+        return reader.read()
+
+    def on_ready(self, path: str, size: int, image: QImage):
+        self._inflight.discard((path, size))
+        pixmap = QPixmap.fromImage(image)
+        if not pixmap.isNull(): PIXMAP_CACHE.put(path, pixmap, size=(size, size))
+        self.thumbnail_ready.emit(path, size, pixmap)
+
+
 # =====================================================================
 # Forge バックグラウンド処理・ヘルパー関数群
 # =====================================================================
 
-def get_cpu_temperature() -> float:
+def _find_temperature_sensor(node: dict, path: tuple = ()) -> tuple | None:
+    """LibreHardwareMonitor のツリーから CPU 温度のセンサ (Package / Core) を探し、子の添字の並びで返す"""
+    children = node.get("Children", [])
+    if node.get("Text") == "Temperatures":
+        for i, child in enumerate(children):
+            if ("Package" in child.get("Text", "") or "Core" in child.get("Text", "")) and _sensor_value(child) is not None: return path + (i,)
+    for i, child in enumerate(children):
+        if (found := _find_temperature_sensor(child, path + (i,))) is not None: return found
+    return None
+
+def _sensor_value(node: dict, path: tuple = ()) -> float | None:
     try:
-        res = requests.get("http://localhost:8085/data.json", timeout=1)
-        if res.status_code == 200:
-            data = res.json()
-            def find_temp(node):
-                if node.get("Text") == "Temperatures":
-                    for child in node.get("Children", []):
-                        if "Package" in child.get("Text", "") or "Core" in child.get("Text", ""):
-                            val_str = child.get("Value", "").replace("°C", "").strip()
-                            try: return float(val_str)
-                            except: pass
-                for child in node.get("Children", []):
-                    t = find_temp(child)
-                    if t is not None: return t
-                return None
-            temp = find_temp(data)
-            if temp is not None: return temp
-    except: pass
-    return -1.0
-
-def expand_prompts(prompt_template: str) -> list[str]:
+        for i in path: node = node["Children"][i]
+        return float(node.get("Value", "").replace("°C", "").strip())
+    except (LookupError, TypeError, ValueError, AttributeError): return None
+
+class TelemetryPoller(QObject):
+    """Forge の進捗と CPU 温度を専用のスレッドで定期的に取得し、最後の値を取得時刻付きで保持する。
+    更新はシグナルで通知するので、GUI スレッドも生成ループも通信を待たされない。
+    取得するのは watch() で登録された生成の実行中だけで、誰も見ていなければスレッドは終了する"""
+    progress_updated = Signal(float)
+    temperature_updated = Signal(float)
+
+    def __init__(self):
+        super().__init__()
+        self.progress, self.temperature = (0.0, 0.0), (-1.0, 0.0)  # (値, 取得時刻 time.monotonic())
+        self._watchers, self._thread, self._lock, self._ready = set(), None, threading.Lock(), threading.Event()
+        self._session, self._sensor = requests.Session(), None  # _sensor: 前回見つけた温度センサの (添字の並び, 名前)
+
+    def watch(self, owner, enabled: bool):
+        """owner が生成を実行している間だけ、進捗と CPU 温度を取得する"""
+        with self._lock:
+            if enabled: self._watchers.add(owner)
+            else: self._watchers.discard(owner)
+            if self._watchers and self._thread is None:
+                self._ready.clear(); self._thread = threading.Thread(target=self._run, name="Telemetry", daemon=True); self._thread.start()
+
+    def wait_ready(self, timeout: float) -> bool:
+        """取得を始めてから最初の CPU 温度の取得 (失敗を含む) が終わるまで待つ (生成スレッドから呼ぶ)"""
+        return self._ready.wait(timeout)
+
+    def cpu_temperature(self) -> float:
+        """最後に取得した CPU 温度 (取得できていない・古い場合は -1.0)"""
+        value, at = self.temperature
+        return value if time.monotonic() - at <= TELEMETRY_STALE_S else -1.0
+
+    def _run(self):
+        next_progress = next_temperature = 0.0
+        while True:
+            with self._lock:
+                if not self._watchers: self._thread = None; return
+            now = time.monotonic()
+            if now >= next_progress:
+                next_progress = now + TELEMETRY_PROGRESS_S
+                if (value := self._read_progress()) is not None: self.progress = (value, time.monotonic()); self.progress_updated.emit(value)
+            if now >= next_temperature:
+                next_temperature = now + TELEMETRY_TEMPERATURE_S
+                if (value := self._read_temperature()) is not None: self.temperature = (value, time.monotonic()); self.temperature_updated.emit(value)
+                self._ready.set()
+            time.sleep(max(0.05, min(next_temperature, next_progress) - time.monotonic()))
+
+    def _read_progress(self) -> float | None:
+        """接続先のうち、最も進んでいる生成の進捗 (0.0 〜 1.0)"""
+        values = []
+        for backend in GENERATION_BACKENDS:
+            try: values.append(float(backend.client.progress().get("progress", 0.0)))
+            except Exception: pass
+        return max(values) if values else None
+
+    def _read_temperature(self) -> float | None:
+        try: data = self._session.get(HARDWARE_MONITOR_URL, timeout=1).json()
+        except Exception: return None
+        if self._sensor:  # 前回のセンサが同じ場所にあれば、ツリー全体は探さない
+            path, name = self._sensor; node = data
+            try:
+                for i in path: node = node["Children"][i]
+                if node.get("Text") == name and (value := _sensor_value(node)) is not None: return value
+            except (LookupError, TypeError, AttributeError): pass
+        if (path := _find_temperature_sensor(data)) is None: self._sensor = None; return None
+        node = data
+        for i in path: node = node["Children"][i]
+        self._sensor = (path, node.get("Text")); return _sensor_value(node)
+
+TELEMETRY = TelemetryPoller()
+
+def prompt_options(prompt_template: str) -> list[list[str]]:
+    """{a|b|c} の部分を選択肢のリストに、それ以外を 1 要素のリストにして並べる"""
     parts = re.split(r'(\{[^}]+\})', prompt_template)
     options_list = []
     for part in parts:
@@ -80,34 +403,103 @@ def expand_prompts(prompt_template: str) -> list[str]:
             options_list.append([c.strip() for c in part[1:-1].split('|')])
         else:
             options_list.append([part])
-    return ["".join(comb) for comb in itertools.product(*options_list)]
+    return options_list
 
 def get_next_sequence_number(directory: str) -> int:
     if not os.path.exists(directory): return 1
     max_num = 0
     for filename in os.listdir(directory):
-        if m := re.match(r'^(\d{5})-.*\.png$', filename, re.IGNORECASE):
+        if m := re.match(r'^(\d{5})-.*\.png(?:' + re.escape(PARTIAL_SUFFIX) + r')?$', filename, re.IGNORECASE):  # 他のプロセスが書き込み中の番号も数える
             num = int(m.group(1))
             if num > max_num: max_num = num
     return max_num + 1
 
-def create_generation_tasks(base_payload: dict, steps_list: list[int], batch_count: int, fixed_seed: bool) -> list[dict]:
-    tasks = []
-    prompts = expand_prompts(base_payload.get("prompt", ""))
-    current_seed = base_payload.get("seed", -1)
-    if current_seed == -1: current_seed = random.randint(0, 4294967295)    
-
-    actual_batch = 1 if len(steps_list) > 1 else batch_count
-    for batch_idx in range(actual_batch):
-        for prompt in prompts:
-            for step_val in steps_list:
-                task = base_payload.copy()
-                task["prompt"] = prompt
-                task["steps"] = step_val
-                task["seed"] = (current_seed + batch_idx) if fixed_seed else current_seed
-                if not fixed_seed: current_seed += 1
-                tasks.append(task)
-    return tasks
+class _DirectoryLock:
+    """フォルダ内のロックファイルによるプロセス間の排他 (連番を確保する一瞬だけ保持する)"""
+    def __init__(self, directory: str): self.path = os.path.join(directory, SEQUENCE_LOCK_NAME)
+    def __enter__(self):
+        self.f = open(self.path, "a+b")
+        if os.name == "nt": import msvcrt; self.f.seek(0); msvcrt.locking(self.f.fileno(), msvcrt.LK_LOCK, 1)
+        else: import fcntl; fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        return self
+    def __exit__(self, *exc):
+        try:
+            if os.name == "nt": import msvcrt; self.f.seek(0); msvcrt.locking(self.f.fileno(), msvcrt.LK_UNLCK, 1)
+            else: import fcntl; fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        finally: self.f.close()
+        return False
+
+class SequenceAllocator:
+    """出力フォルダごとの連番の払い出し。フォルダの走査は最初の 1 回と、他のプロセスや外部でフォルダが変更されたとき
+    (フォルダの更新時刻が前回の確保時から変わっていたとき) だけ行い、それ以外はメモリ上の次の番号から払い出す。
+    ファイル名はロックファイルで排他したうえで排他的な作成 (O_EXCL) で確保するので、複数のスレッドやプロセスが同じフォルダに保存しても重ならない"""
+    _instances, _instances_lock = {}, threading.Lock()
+
+    @classmethod
+    def for_directory(cls, directory: str) -> "SequenceAllocator":
+        key = os.path.normcase(os.path.abspath(directory))
+        with cls._instances_lock:
+            if (allocator := cls._instances.get(key)) is None: allocator = cls._instances[key] = cls(directory)
+            return allocator
+
+    def __init__(self, directory: str):
+        self.directory, self.next_num, self.dir_mtime_ns, self.lock = directory, 0, None, threading.Lock()
+
+    def claim(self, suffix: str) -> tuple[int, str]:
+        """{連番:05d}-{suffix}.png の番号を確保し、(連番, パス) を返す。確保の印としてパス + PARTIAL_SUFFIX の空のファイルを作るので、
+        呼び出し側はそこへ書き込んでから commit() でパスへ改名する (.png の名前では書き終えたファイルしか現れない)"""
+        with self.lock, _DirectoryLock(self.directory):
+            if os.stat(self.directory).st_mtime_ns != self.dir_mtime_ns: self.next_num = max(self.next_num, get_next_sequence_number(self.directory))
+            while True:
+                num = self.next_num; self.next_num += 1; path = os.path.join(self.directory, f"{num:05d}-{suffix}.png")
+                if os.path.exists(path): continue
+                try: os.close(os.open(path + PARTIAL_SUFFIX, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)); break
+                except FileExistsError: continue  # 走査後に外部で作られていた番号は飛ばす
+            self.dir_mtime_ns = os.stat(self.directory).st_mtime_ns  # 自分の作成を含めた時刻を覚えておき、次回はこれと比べる
+            return num, path
+
+    def commit(self, path: str):
+        """claim() で確保したパス + PARTIAL_SUFFIX を書き終えたあとに呼び、パスへ改名する。改名でフォルダの更新時刻が変わっても
+        次の claim() が走査し直さないよう、それまでに他から変更されていなければ改名後の時刻を覚え直す"""
+        with self.lock, _DirectoryLock(self.directory):
+            unchanged = os.stat(self.directory).st_mtime_ns == self.dir_mtime_ns
+            os.replace(path + PARTIAL_SUFFIX, path)
+            if unchanged: self.dir_mtime_ns = os.stat(self.directory).st_mtime_ns
+
+class GenerationTasks:
+    """生成タスクの列 (バッチ × プロンプトの展開 × Steps) を、必要になった番号の分だけその場で組み立てる。
+    組み合わせが数百万件になってもリストを作らないので、件数の取得も任意の番号のタスクの取得もすぐに終わる。
+    並び順とシードの割り当ては、以前の全件を展開していたときと同じ"""
+    def __init__(self, base_payload: dict, steps_list: list[int], batch_count: int, fixed_seed: bool):
+        self.base_payload, self.steps_list, self.fixed_seed = base_payload, steps_list, fixed_seed
+        self.options = prompt_options(base_payload.get("prompt", ""))
+        self.prompt_count = math.prod(len(options) for options in self.options)
+        self.batch_count = 1 if len(steps_list) > 1 else batch_count
+        self.per_batch = self.prompt_count * len(steps_list)
+        self.seed = base_payload.get("seed", -1)
+        if self.seed == -1: self.seed = random.randint(0, 4294967295)
+
+    def __len__(self) -> int: return self.batch_count * self.per_batch
+
+    def prompt_at(self, index: int) -> str:
+        """展開したプロンプトのうち index 番目 (itertools.product と同じく、後ろの {} ほど速く変わる)"""
+        parts = []
+        for options in reversed(self.options):
+            index, i = divmod(index, len(options)); parts.append(options[i])
+        return "".join(reversed(parts))
+
+    def __getitem__(self, index: int) -> dict:
+        if index < 0: index += len(self)
+        if not 0 <= index < len(self): raise IndexError("task index out of range")
+        batch_idx, rest = divmod(index, self.per_batch); prompt_idx, step_idx = divmod(rest, len(self.steps_list))
+        task = self.base_payload.copy()
+        task["prompt"] = self.prompt_at(prompt_idx)
+        task["steps"] = self.steps_list[step_idx]
+        task["seed"] = (self.seed + batch_idx) if self.fixed_seed else self.seed + index
+        return task
+
+def create_generation_tasks(base_payload: dict, steps_list: list[int], batch_count: int, fixed_seed: bool) -> GenerationTasks:
+    return GenerationTasks(base_payload, steps_list, batch_count, fixed_seed)
 
 
 # =====================================================================
@@ -166,122 +558,244 @@ class GenerationThread(QThread):
     error_occurred = Signal(str)
     generation_started = Signal()
 
-    def __init__(self, tasks: list[dict], interval: int, target_temp: float, target_model: str, output_dir: str, forever_mode: bool, fixed_seed: bool):
+    def __init__(self, tasks: list[dict], interval: int, target_temp: float, target_model: str, output_dir: str, forever_mode: bool, fixed_seed: bool, backends: list[ForgeBackend] | None = None, skip_existing: bool = False):
         super().__init__()
         self.tasks, self.interval, self.target_temp, self.target_model, self.output_dir, self.forever_mode = tasks, interval, target_temp, target_model, output_dir, forever_mode
         self.fixed_seed = fixed_seed
+        self.backends = backends or GENERATION_BACKENDS
+        self.task_idx, self.total_tasks = 0, len(tasks)
+        self._retry_tasks = deque()  # 失敗した接続先から戻されたタスク (他の接続先で先に生成する)
+        self._alive_backends, self._in_flight, self._failed_backends = len(self.backends), 0, set()
+        self.backend_stats = {backend.name: [0, None] for backend in self.backends}  # 名前 -> [生成枚数, 最初の生成の開始時刻]
+        self.skip_existing, self.output_index, self.skipped_count = skip_existing, None, 0  # 出力フォルダに同じ条件の画像があるタスクは飛ばす
+        self.throttles = {backend.name: ThermalThrottle(target_temp, interval, name=backend.name) for backend in self.backends}  # 接続先ごとの温度スロットル
+        self.thermal_log_path = None  # 温度スロットルの制御ログ (CSV) の書き出し先
         self.is_running = True
 
         self._mutex = QMutex()
         self._pending_update = None # 更新待機用の変数
         self.has_generated = False  # パラメータ更新時のタイマー継続用
+        self._results = queue.Queue(maxsize=GENERATION_QUEUE_SIZE)  # (番号, ペイロード, 応答) → 保存スレッド (None で終了)
+        self._next_ticket, self._reorder, self._dropped_tickets = 0, {}, set()  # 払い出した番号、番号 -> 順番待ちの結果、生成しなくなった番号
+        self._persist_failed = False
 
     def update_parameters(self, base_payload: dict, steps_list: list[int], fixed_seed: bool, interval: int, target_temp: float):
         """UIスレッドから呼ばれる：次回のループで適用するパラメータを安全に予約する"""
         with QMutexLocker(self._mutex):
             self._pending_update = (base_payload, steps_list, fixed_seed, interval, target_temp)
 
+    def _persist(self, task: dict, res):
+        """生成結果のデコードと保存 (保存スレッドで実行)。まとめて生成した応答は 1 枚ずつのファイルに分ける"""
+        result = res.json(); count = task.get("batch_size", 1) * task.get("n_iter", 1)
+        infotexts = json.loads(result["info"]).get("infotexts", [result["info"]]) if "info" in result else []
+        # グリッド画像が付いていれば先頭に入るので、後ろから count 枚を使う
+        for i, (image, infotext) in enumerate(zip(result["images"][-count:], (infotexts[-count:] if infotexts else [None] * count))):
+            self._persist_image(dict(task, seed=task["seed"] + i), base64.b64decode(image), {"parameters": infotext} if infotext is not None else {})
+
+    def _persist_image(self, task: dict, img_data: bytes, texts: dict):
+        date_str = date.today().strftime("%Y-%m-%d"); date_dir = os.path.join(self.output_dir, date_str); os.makedirs(date_dir, exist_ok=True)
+        allocator = SequenceAllocator.for_directory(date_dir); seq_num, filepath = allocator.claim(str(task['seed'])); partial_path = filepath + PARTIAL_SUFFIX
+        try:
+            # PNG ならテキストチャンクを差し込んでそのまま書き出す (画素の展開・再圧縮をしない)。PNG 以外の応答のときだけ PIL で変換する
+            try: png_data = splice_png_text(img_data, texts)
+            except PngChunkError: png_data = None
+            if png_data is not None:
+                with open(partial_path, "wb") as f: f.write(png_data)
+            else:
+                pnginfo = PngImagePlugin.PngInfo()
+                for key, value in texts.items(): pnginfo.add_text(key, value)
+                Image.open(io.BytesIO(img_data)).save(partial_path, format="PNG", pnginfo=pnginfo)
+            allocator.commit(filepath)  # 書き終えたファイルを一度に .png として出す (フォルダの監視が空や書きかけのファイルを拾わない)
+        except Exception:
+            try: os.remove(partial_path)  # 確保した書きかけのファイルを残さない
+            except OSError: pass
+            raise
+        if self.output_index is not None and "parameters" in texts: self.output_index.add(parse_metadata(texts["parameters"]))
+        self.image_generated.emit(filepath, f"Seed: {task['seed']} | Steps: {task['steps']} | Prompt: {task['prompt'][:40]}...", task['seed'])
+
+    def _persist_loop(self):
+        """タスクを払い出した番号の順に保存する。複数の接続先で応答の順が前後しても、先の番号の結果が届くまで後の結果は
+        self._reorder で待たせるので、連番はタスクの順のまま。生成しなくなった番号 (パラメータ更新で捨てたタスク) は飛ばす"""
+        next_ticket = 0
+        while True:
+            try: item = self._results.get(timeout=0.2)
+            except queue.Empty: item = ()
+            if item is None: break
+            if item: self._reorder[item[0]] = item[1:]
+            with QMutexLocker(self._mutex): dropped, self._dropped_tickets = self._dropped_tickets, set()
+            for ticket in dropped: self._reorder[ticket] = None
+            while next_ticket in self._reorder:
+                if (result := self._reorder.pop(next_ticket)) is not None: self._save(*result)
+                next_ticket += 1
+        for ticket in sorted(self._reorder):  # 中断やエラーで届かなかった番号は飛ばして、残りを番号順に保存する
+            if (result := self._reorder.pop(ticket)) is not None: self._save(*result)
+
+    def _save(self, task: dict, res):
+        """失敗したら以降の結果は捨て、生成ループにも止まってもらう"""
+        if self._persist_failed: return
+        try: self._persist(task, res)
+        except Exception as e:
+            self._persist_failed = True
+            if self.is_running: self.error_occurred.emit(f"保存エラー: {str(e)}")
+
     def run(self):
-        task_idx, total_tasks = 0, len(self.tasks)
+        # 生成リクエストと保存を別スレッドに分け、レスポンスが届いたらすぐ次のリクエストを送る (GPU を保存処理の間も遊ばせない)
+        TELEMETRY.watch(self, True)  # 進捗と CPU 温度の取得は、生成を実行している間だけ行う
+        try:
+            if self.skip_existing:
+                self.status_updated.emit("🔎 生成済みの画像を確認中..."); self.output_index = OutputIndex(METADATA_INDEX, self.output_dir)
+            if self.target_temp < 100.0: TELEMETRY.wait_ready(TELEMETRY_STALE_S)  # 温度を確かめずに最初の生成を始めない
+            persister = threading.Thread(target=self._persist_loop, name="GenerationPersist", daemon=True); persister.start()
+            try: self._request_loop()
+            finally:
+                self._results.put(None); persister.join(); self._export_thermal_log()
+        finally: TELEMETRY.watch(self, False)
+        self.finished_all.emit()
 
-        while self.is_running:
-            
-            # --- 【修正】1. 先にインターバル・温度の待機処理を行う ---
-            if self.has_generated or self.target_temp < 100.0:                
+    def _export_thermal_log(self):
+        """温度スロットルが動いていれば、オフラインで調整を確かめられるよう制御ログを cache に書き出す"""
+        if not (throttles := [throttle for throttle in self.throttles.values() if throttle.log]): return
+        path = os.path.join(CACHE_DIR, f"thermal-{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+        try: export_log(path, throttles); self.thermal_log_path = path
+        except OSError: pass
+
+    def _request_loop(self):
+        # 接続先ごとのワーカーが共有のタスク列から順にタスクを取る (手の空いた接続先が次のタスクを取るので、負荷の低い方に割り当てられる)
+        if len(self.backends) == 1: self._backend_loop(self.backends[0]); return
+        workers = [threading.Thread(target=self._backend_loop, args=(backend,), name=f"Generation-{backend.name}", daemon=True) for backend in self.backends]
+        for worker in workers: worker.start()
+        for worker in workers: worker.join()
+
+    def _apply_pending_update(self):
+        """予約されたパラメータ更新を反映する (self._mutex を取った状態で呼ぶ)"""
+        if not self._pending_update: return
+        base_payload, steps_list, self.fixed_seed, self.interval, self.target_temp = self._pending_update
+        self._pending_update = None
+
+        next_seed = self.tasks[self.task_idx % self.total_tasks]["seed"]
+        if self.task_idx >= self.total_tasks: next_seed += (self.task_idx // self.total_tasks) * self.total_tasks
+        base_payload["seed"] = next_seed
+        self.tasks = create_generation_tasks(base_payload, steps_list, 1, self.fixed_seed)
+        self._dropped_tickets.update(item[3] for item in self._retry_tasks)
+        self.total_tasks, self.task_idx = len(self.tasks), 0; self._retry_tasks.clear()
+
+    def _task_at(self, task_idx: int) -> dict:
+        task = self.tasks[task_idx % self.total_tasks].copy()
+        if task_idx >= self.total_tasks: task["seed"] += (task_idx // self.total_tasks) * self.total_tasks
+        return task
+
+    def _is_generated(self, task: dict, model: str) -> bool:
+        return self.output_index is not None and (dict(task, override_settings={"sd_model_checkpoint": model}) if model else task) in self.output_index
+
+    def _take_task(self, model: str = "") -> tuple[int, dict, int, int] | None:
+        """次に生成するタスクを (通し番号, ペイロード, 枚数, 保存の順番) で返す。すべて生成済みなら None。
+        後に続くタスクがシードだけ連番で異なるなら、GENERATION_BATCH_MAX 枚までまとめて 1 つのタスクにする (シードは先頭のもの)。
+        生成済みのスキップが有効なら、model で生成した場合の条件が出力フォルダにあるタスクは飛ばして数える"""
+        with QMutexLocker(self._mutex):
+            self._apply_pending_update()
+            if self._retry_tasks: self._in_flight += 1; return self._retry_tasks.popleft()
+            while self.forever_mode or self.task_idx < self.total_tasks:
+                task_idx = self.task_idx; self.task_idx += 1
+                task = self._task_at(task_idx)
+                if self._is_generated(task, model): self.skipped_count += 1; continue
+                count = 1
+                while count < GENERATION_BATCH_MAX and (self.forever_mode or self.task_idx < self.total_tasks):
+                    following = self._task_at(self.task_idx)
+                    if following != dict(task, seed=task["seed"] + count) or self._is_generated(following, model): break
+                    self.task_idx += 1; count += 1
+                ticket = self._next_ticket; self._next_ticket += 1
+                self._in_flight += 1; return task_idx, task, count, ticket
+            return None
+
+    def _mode_str(self, task_idx: int, count: int, backend: ForgeBackend) -> str:
+        numbers = f"{task_idx+1}-{task_idx+count}" if count > 1 else f"{task_idx+1}"
+        mode_str = f" [∞ 無限モード #{numbers}]" if self.forever_mode else f" [{numbers}/{self.total_tasks}]"
+        if self.skipped_count: mode_str += f" (生成済み {self.skipped_count} 件をスキップ)"
+        return mode_str + (f" @{backend.name}" if len(self.backends) > 1 else "")
+
+    def _throughput_str(self) -> str:
+        """処理速度 (枚/分)。複数の接続先に振り分けているときは、接続先ごとの生成枚数と処理速度を表示する"""
+        now = time.time(); rate = lambda count, since: count / (now - since) * 60 if since and now > since else 0.0
+        if len(self.backends) == 1:
+            count, since = self.backend_stats[self.backends[0].name]
+            return f" | {rate(count, since):.1f}枚/分" if count else ""
+        return " | " + "  ".join(f"{name}: {count}枚 " + ("(切り離し)" if name in self._failed_backends else f"({rate(count, since):.1f}枚/分)") for name, (count, since) in self.backend_stats.items())
+
+    def _backend_loop(self, backend: ForgeBackend):
+        has_generated, throttle, last_count = self.has_generated, self.throttles[backend.name], 1
+
+        while self.is_running and not self._persist_failed:
+
+            # --- 1. インターバル・温度の待機 (接続先ごとに行う) ---
+            if has_generated or self.target_temp < 100.0:
+                # 上限温度があれば、生成直後の温度から次の生成までの待ち時間をスロットルに決めてもらう (最短でもインターバル分は待つ)
+                delay = 0.0
+                if has_generated and self.target_temp < 100.0:
+                    throttle.target_temp, throttle.min_delay = self.target_temp, self.interval * last_count
+                    delay = throttle.next_delay(TELEMETRY.cpu_temperature(), time.time())
                 start_time = time.time()
                 while self.is_running:
                     # 待機ループ中にもパラメータ更新を監視し、タスク情報を更新する（UI表示即時反映のため）
-                    self._mutex.lock()
-                    if self._pending_update:
-                        #base_payload, steps_list, new_fixed_seed = self._pending_update
-                        base_payload, steps_list, new_fixed_seed, new_interval, new_target_temp = self._pending_update
-                        self._pending_update = None
-                        self.fixed_seed = new_fixed_seed
-                        self.interval = new_interval
-                        self.target_temp = new_target_temp
-                        
-                        idx_in_list = task_idx % total_tasks
-                        next_seed = self.tasks[idx_in_list]["seed"]
-                        if task_idx >= total_tasks:
-                            next_seed += (task_idx // total_tasks) * total_tasks
-                        
-                        base_payload["seed"] = next_seed
-                        self.tasks = create_generation_tasks(base_payload, steps_list, 1, self.fixed_seed)
-                        total_tasks = len(self.tasks)
-                        task_idx = 0
-                    self._mutex.unlock()
-
+                    with QMutexLocker(self._mutex): self._apply_pending_update()
                     elapsed = time.time() - start_time
-                    time_ok = (elapsed >= self.interval) if self.has_generated else True
-                    temp = get_cpu_temperature()
-                    temp_ok = (temp <= self.target_temp) if temp != -1.0 else True
+                    wait_s = max(self.interval * last_count, delay) if has_generated else 0  # まとめて生成したときは枚数分のインターバルをとる
+                    time_ok = elapsed >= wait_s
+                    temp = TELEMETRY.cpu_temperature()
+                    temp_ok = (temp <= self.target_temp) if temp != -1.0 else True  # 自動調整の結果にかかわらず、上限を超えたまま生成は始めない
                     temp_str = f"{temp}℃" if temp != -1.0 else "取得不可"
-                    rem = max(0, int(self.interval - elapsed)) if self.has_generated else 0
-                    mode_str = f" [∞ 無限ループ中 #{task_idx+1}]" if self.forever_mode else f" [{task_idx+1}/{total_tasks}]"
-                    self.status_updated.emit(f"⏳ 待機中{mode_str} | 残り: {rem}秒 | CPU温度: {temp_str} (目標 <= {self.target_temp}℃)")
+                    rem = max(0, int(wait_s - elapsed))
+                    auto_str = f" (温度から自動調整: {delay:.0f}秒)" if delay > self.interval * last_count else ""
+                    mode_str = f" [∞ 無限ループ中 #{self.task_idx+1}]" if self.forever_mode else f" [{self.task_idx+1}/{self.total_tasks}]"
+                    if len(self.backends) > 1: mode_str += f" @{backend.name}"
+                    self.status_updated.emit(f"⏳ 待機中{mode_str} | 残り: {rem}秒{auto_str} | CPU温度: {temp_str} (目標 <= {self.target_temp}℃){self._throughput_str()}")
                     if time_ok and temp_ok: break
                     time.sleep(1)
 
             if not self.is_running: break
 
-            # --- 【修正】2. 待機をスキップした場合に備え、生成直前にもタスクの更新を検知して切り替える ---
-            self._mutex.lock()
-            if self._pending_update:
-                #base_payload, steps_list, new_fixed_seed = self._pending_update
-                base_payload, steps_list, new_fixed_seed, new_interval, new_target_temp = self._pending_update
-                self._pending_update = None
-                self.fixed_seed = new_fixed_seed
-                self.interval = new_interval
-                self.target_temp = new_target_temp
-                
-                idx_in_list = task_idx % total_tasks
-                next_seed = self.tasks[idx_in_list]["seed"]
-                if task_idx >= total_tasks:
-                    next_seed += (task_idx // total_tasks) * total_tasks
-                
-                base_payload["seed"] = next_seed
-                self.tasks = create_generation_tasks(base_payload, steps_list, 1, self.fixed_seed)
-                total_tasks = len(self.tasks)
-                task_idx = 0
-            self._mutex.unlock()
-            
-            # --- 【修正】3. 最新のタスク情報を取得 ---
-            idx_in_list = task_idx % total_tasks
-            task = self.tasks[idx_in_list].copy()
-            if task_idx >= total_tasks: task["seed"] += (task_idx // total_tasks) * total_tasks
-            if self.target_model: task["override_settings"] = {"sd_model_checkpoint": self.target_model}
-
-            # --- 4. 生成処理を実行 ---
-            mode_str = f" [∞ 無限モード #{task_idx+1}]" if self.forever_mode else f" [{task_idx+1}/{total_tasks}]"
-            self.status_updated.emit(f"🎨 画像を生成中...{mode_str} Steps:{task['steps']} / Seed:{task['seed']}")
+            # --- 2. 最新のタスク情報を取得 (パラメータ更新もここで反映される) ---
+            # 先のタスクの結果を待って保存できずにいる結果が多ければ、戻されたタスクがない限り新しいタスクは取らない (遅い接続先を待つ間のメモリを抑える)
+            while len(self._reorder) >= GENERATION_REORDER_LIMIT and not self._retry_tasks and self.is_running: time.sleep(0.05)
+            # 他の接続先で生成中のタスクがあれば、失敗して戻されるかもしれないので終わるまで待つ
+            while (item := self._take_task(backend.model or self.target_model)) is None and self._in_flight and self.is_running: time.sleep(0.2)
+            if item is None: break
+            task_idx, task, count, ticket = item
+            payload = dict(task)
+            if model := backend.model or self.target_model: payload["override_settings"] = {"sd_model_checkpoint": model}
+            if count > 1:
+                batch_size = GENERATION_BATCH_SIZE if count % GENERATION_BATCH_SIZE == 0 else 1
+                payload["batch_size"], payload["n_iter"] = batch_size, count // batch_size  # Forge は seed から連番のシードで生成する
+
+            # --- 3. 生成リクエストを送り、結果を保存スレッドへ渡す ---
+            seeds = f"{task['seed']}-{task['seed'] + count - 1}" if count > 1 else f"{task['seed']}"
+            self.status_updated.emit(f"🎨 画像を生成中...{self._mode_str(task_idx, count, backend)} Steps:{task['steps']} / Seed:{seeds}{self._throughput_str()}")
             self.generation_started.emit()
-            
-            try:
-                res = requests.post(f"{FORGE_URL}/sdapi/v1/txt2img", json=task, timeout=300); res.raise_for_status(); result = res.json()
-                img_data = base64.b64decode(result["images"][0]); image = Image.open(io.BytesIO(img_data))
-                date_str = date.today().strftime("%Y-%m-%d"); date_dir = os.path.join(self.output_dir, date_str); os.makedirs(date_dir, exist_ok=True)
-                seq_num = get_next_sequence_number(date_dir); filename = f"{seq_num:05d}-{task['seed']}.png"; filepath = os.path.join(date_dir, filename)
-                pnginfo = PngImagePlugin.PngInfo()
-                if "info" in result:
-                    info_dict = json.loads(result["info"]); pnginfo.add_text("parameters", info_dict.get("infotexts", [result["info"]])[0])
-                image.save(filepath, pnginfo=pnginfo)
-                self.image_generated.emit(filepath, f"Seed: {task['seed']} | Steps: {task['steps']} | Prompt: {task['prompt'][:40]}...", task['seed'])
-            except Exception as e:
-                if self.is_running: self.error_occurred.emit(f"生成エラー: {str(e)}")
-                break
-
-            self.has_generated = True
-
-            task_idx += 1
-            if not self.forever_mode and task_idx >= total_tasks: break
-        
-        self.finished_all.emit()
+            started = time.time()
+            if self.target_temp < 100.0: throttle.start_generation(TELEMETRY.cpu_temperature(), started)
+            try: res = backend.client.txt2img(payload)
+            except Exception as e: self._backend_failed(backend, item, e); break
+            with QMutexLocker(self._mutex):
+                self._in_flight -= 1; stats = self.backend_stats[backend.name]; stats[0] += count; stats[1] = stats[1] or started
+            if self._persist_failed: break
+            self._results.put((ticket, payload, res))  # 保存が詰まっている間だけここで待つ
+            has_generated = self.has_generated = True; last_count = count
+
+    def _backend_failed(self, backend: ForgeBackend, item: tuple[int, dict, int, int], error: Exception):
+        """失敗した接続先を切り離す。他の接続先が残っていればタスクを戻してそちらに任せ、最後の接続先だった場合はエラーを通知する"""
+        with QMutexLocker(self._mutex):
+            self._alive_backends -= 1; others_alive = self._alive_backends > 0; self._failed_backends.add(backend.name)
+            if others_alive: self._retry_tasks.appendleft(item)
+            self._in_flight -= 1
+        if not self.is_running: return
+        if others_alive: self.status_updated.emit(f"⚠️ {backend.name} を切り離しました: {str(error)}")
+        else: self.error_occurred.emit(f"生成エラー: {str(error)}")
 
     def stop_loop_only(self): self.is_running = False
     def stop_and_interrupt(self):
         self.is_running = False
-        try: requests.post(f"{FORGE_URL}/sdapi/v1/interrupt", timeout=2)
-        except: pass
+        for backend in self.backends:
+            try: backend.client.interrupt()
+            except Exception: pass
 
 # =====================================================================
 # ビューア用＆プレビュー用 ドラッグ対応ラベル
@@ -290,7 +804,7 @@ class GenerationThread(QThread):
 class DraggableImageLabel(QLabel):
     def __init__(self, image_path="", parent=None):
         super().__init__(parent); self.image_path = image_path
-        if image_path and os.path.exists(image_path): self.setPixmap(QPixmap(image_path))
+        if image_path and os.path.exists(image_path): self.setPixmap(PIXMAP_CACHE.get(image_path))
     def mousePressEvent(self, event):
         if event.button() == Qt.MouseButton.LeftButton:
             if self.pixmap() is None or self.pixmap().isNull(): return
@@ -323,7 +837,7 @@ class DraggablePreviewLabel(DraggableImageLabel):
         self.setStyleSheet("border: 2px dashed #aaaaaa; background-color: #2b2b2b; color: #dddddd; font-size: 13px;")
         if urls := event.mimeData().urls(): self.file_dropped.emit(urls[0].toLocalFile())
     def set_preview_image(self, filepath: str):
-        self.image_path, self.original_pixmap = filepath, QPixmap(filepath); self.update_pixmap_display()
+        self.image_path, self.original_pixmap = filepath, PIXMAP_CACHE.get(filepath); self.update_pixmap_display()
     def update_pixmap_display(self):
         if self.original_pixmap and not self.original_pixmap.isNull():
             self.setPixmap(self.original_pixmap.scaled(self.size(), Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
@@ -336,34 +850,6 @@ class DraggablePreviewLabel(DraggableImageLabel):
             original_view.originalWindowClosed.connect(lambda w: QApplication.instance()._original_windows.remove(w) if w in QApplication.instance()._original_windows else None)
 
 
-class ViewerDraggableLabel(DraggableImageLabel):
-    deleteRequested = Signal(str)
-    def __init__(self, image_path, parent=None):
-        super().__init__(image_path, parent); self.setAcceptDrops(True); self.thumbnail_size = 130   
-        self.setFixedSize(self.thumbnail_size + 8, self.thumbnail_size + 8); self.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu); self.customContextMenuRequested.connect(self.showContextMenu)
-    def setup_mime_data(self, mime_data): super().setup_mime_data(mime_data); mime_data.setData("application/x-image-sortable", QByteArray(self.image_path.encode()))
-    def dragEnterEvent(self, event: QDragEnterEvent):
-        if event.mimeData().hasFormat("application/x-image-sortable"): event.acceptProposedAction()
-        else: event.ignore()
-    def dropEvent(self, event: QDropEvent):
-        if event.mimeData().hasFormat("application/x-image-sortable"):
-            source_path = event.mimeData().data("application/x-image-sortable").data().decode(); target_path = self.image_path
-            if source_path == target_path: event.ignore(); return
-            parent = self.parent()
-            while parent:
-                if isinstance(parent, CollectionWidget): parent.swapImages(source_path, target_path); event.acceptProposedAction(); break
-                parent = parent.parent()
-        else: event.ignore()
-    def showContextMenu(self, position):
-        context_menu = QMenu(self); delete_action = context_menu.addAction("削除"); delete_action.triggered.connect(lambda: self.deleteRequested.emit(self.image_path)); context_menu.exec(self.mapToGlobal(position))
-    def mouseDoubleClickEvent(self, event):
-        if self.image_path and os.path.exists(self.image_path):
-            original_view = OriginalViewWindow(self.image_path); original_view.show()
-            if not hasattr(QApplication.instance(), "_original_windows"): QApplication.instance()._original_windows = []
-            QApplication.instance()._original_windows.append(original_view)
-            original_view.originalWindowClosed.connect(lambda w: QApplication.instance()._original_windows.remove(w) if w in QApplication.instance()._original_windows else None)
-
-
 # =====================================================================
 # UIヘルパー（メタデータラベル、ダイアログ、コレクション等）
 # =====================================================================
@@ -471,6 +957,7 @@ class OpenNavigationButton(QPushButton):
     new_folder = Signal()
     def __init__(self, parent=None):
         super().__init__(parent); self.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu); self.current_folder, self.pinned_folders, self.folder_history, self.history_index = "", [], [], -1
+        self.library_mode = False  # True ならサブフォルダを含めたフォルダ全体をひとつの一覧として扱う
         self.clicked.connect(self.open_folder); self.customContextMenuRequested.connect(self.show_context_menu)        
     def create_pinned_folder_widget(self, folder):
         widget = QWidget(); layout = QHBoxLayout(widget); layout.setContentsMargins(20, 0, 5, 0)
@@ -492,12 +979,19 @@ class OpenNavigationButton(QPushButton):
         menu = QMenu(); m_next = menu.addAction("次のフォルダ"); m_next.setEnabled(self.current_folder != ""); m_next.triggered.connect(partial(self.move_folder, 1))
         m_prev = menu.addAction("前のフォルダ"); m_prev.setEnabled(self.current_folder != ""); m_prev.triggered.connect(partial(self.move_folder, -1))
         pinning = menu.addAction("ピン留めする"); pinning.setEnabled(self.current_folder != "" and self.current_folder not in self.pinned_folders); pinning.triggered.connect(self.pin_current_folder)
+        menu.addSeparator()
+        library = menu.addAction("ライブラリモード (サブフォルダもまとめて表示)"); library.setCheckable(True); library.setChecked(self.library_mode); library.setEnabled(self.current_folder != ""); library.triggered.connect(self.set_library_mode)
+        open_library = menu.addAction("出力フォルダをライブラリとして開く"); open_library.triggered.connect(self.open_output_library)
         if self.pinned_folders:
             menu.addSeparator()       
             for folder in self.pinned_folders:
                 widget = self.create_pinned_folder_widget(folder); widget.mouseReleaseEvent = lambda event, f=folder: self.handle_pinned_folder_click(event, f)
                 widget_action = QWidgetAction(menu); widget_action.setDefaultWidget(widget); menu.addAction(widget_action)
         menu.exec(self.mapToGlobal(pos))
+    def set_library_mode(self, enabled, reload=True):
+        self.library_mode = bool(enabled); self.setText("Lib" if self.library_mode else "Open")
+        if reload and self.current_folder: self.new_folder.emit()
+    def open_output_library(self): self.set_library_mode(True, reload=False); self.navigate_to_folder(os.path.abspath(DEFAULT_OUTPUT_DIR))
     def pin_current_folder(self):
         if self.current_folder and self.current_folder not in self.pinned_folders: self.pinned_folders.append(self.current_folder)
     def open_folder(self):
@@ -524,39 +1018,108 @@ class SliderPopup(QFrame):
     def update_page_display(self, index, total): self.lbl_page.setText(f"{index}/{total}" if total > 0 else "0/0")
 
 
-class FlowLayout(QLayout):    
-    def __init__(self, parent=None): super().__init__(parent); self.setContentsMargins(5, 5, 5, 5); self.setSpacing(5); self.items = []
-    def __del__(self):
-        while item := self.takeAt(0): pass
-    def addItem(self, item): self.items.append(item)
-    def count(self): return len(self.items)
-    def itemAt(self, index): return self.items[index] if 0 <= index < self.count() else None
-    def takeAt(self, index): return self.items.pop(index) if 0 <= index < self.count() else None
-    def expandingDirections(self): return Qt.Orientation(0)
-    def hasHeightForWidth(self): return True
-    def heightForWidth(self, width): return self.do_layout(QRect(0, 0, width, 0))
-    def sizeHint(self): return self.minimumSize()
-    def minimumSize(self):
-        size = QSize()
-        for item in self.items: size = size.expandedTo(item.minimumSize())
-        margin = self.contentsMargins()
-        return size + QSize(margin.left() + margin.right(), margin.top() + margin.bottom())
-    def setGeometry(self, rect): super().setGeometry(rect); self.do_layout(rect)
-    def do_layout(self, rect):
-        x, y, line_height, layout_spacing = rect.x(), rect.y(), 0, self.spacing()
-        for item in self.items:
-            next_x = x + item.sizeHint().width() + layout_spacing
-            if next_x - layout_spacing > rect.right() and line_height > 0:
-                x, y = rect.x(), y + line_height + layout_spacing
-                next_x = x + item.sizeHint().width() + layout_spacing; line_height = 0
-            item.setGeometry(QRect(QPoint(x, y), item.sizeHint())); x = next_x; line_height = max(line_height, item.sizeHint().height())
-        return y + line_height - rect.y()
+class CollectionModel(QAbstractListModel):
+    """コレクションの画像パスを保持するモデル。サムネイルは表示されるタイルの分だけ ThumbnailStore に要求する"""
+    SORTABLE_MIME = "application/x-image-sortable"
+
+    def __init__(self, thumbnail_size=130, parent=None):
+        super().__init__(parent); self.images, self._rows, self._failed, self.thumbnail_size = [], {}, set(), thumbnail_size
+        self.store = ThumbnailStore.instance(); self.store.thumbnail_ready.connect(self.on_thumbnail_ready)
+    def rowCount(self, parent=QModelIndex()): return 0 if parent.isValid() else len(self.images)
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or not (0 <= index.row() < len(self.images)): return None
+        path = self.images[index.row()]
+        if role == Qt.ItemDataRole.DecorationRole: return None if path in self._failed else self.store.request(path, self.thumbnail_size)
+        if role == Qt.ItemDataRole.DisplayRole: return "×" if path in self._failed else "読込中..."  # サムネイルが無い間の表示
+        if role in (Qt.ItemDataRole.UserRole, Qt.ItemDataRole.ToolTipRole): return path
+        return None
+    def flags(self, index):
+        return super().flags(index) | Qt.ItemFlag.ItemIsDragEnabled if index.isValid() else super().flags(index)
+    def __contains__(self, path): return path in self._rows
+    def _reindex(self): self._rows = {path: row for row, path in enumerate(self.images)}
+    def append(self, paths: list[str]):
+        if not paths: return
+        self.beginInsertRows(QModelIndex(), len(self.images), len(self.images) + len(paths) - 1)
+        for path in paths: self._rows[path] = len(self.images); self.images.append(path)
+        self.endInsertRows()
+    def remove(self, path: str):
+        if (row := self._rows.get(path)) is None: return
+        self.beginRemoveRows(QModelIndex(), row, row); self.images.pop(row); self._failed.discard(path); self._reindex(); self.endRemoveRows()
+    def move_before(self, source_path: str, target_path: str):
+        """source を target の位置に挿入する (従来の swapImages と同じ並べ替え)"""
+        if source_path not in self._rows or target_path not in self._rows or source_path == target_path: return
+        source, target = self._rows[source_path], self._rows[target_path]
+        if target == source + 1: return  # すでに target の直前にある
+        # beginMoveRows で移動を伝えるので、ビューの現在の項目や選択 (永続インデックス) も移動した行についていく
+        self.beginMoveRows(QModelIndex(), source, source, QModelIndex(), target)
+        self.images.insert(target - (source < target), self.images.pop(source)); self._reindex()
+        self.endMoveRows()
+    def clear(self):
+        self.beginResetModel(); self.images.clear(); self._rows.clear(); self._failed.clear(); self.endResetModel()
+    def on_thumbnail_ready(self, path, size, pixmap):
+        if size != self.thumbnail_size or (row := self._rows.get(path)) is None: return
+        if pixmap.isNull(): self._failed.add(path)
+        index = self.index(row); self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole, Qt.ItemDataRole.DisplayRole])
+
+
+class CollectionItemDelegate(QStyledItemDelegate):
+    def __init__(self, thumbnail_size=130, parent=None): super().__init__(parent); self.thumbnail_size = thumbnail_size
+    def sizeHint(self, option, index): return QSize(self.thumbnail_size + 8, self.thumbnail_size + 8)
+    def paint(self, painter, option, index):
+        rect = option.rect.adjusted(1, 1, -1, -1); painter.save()
+        if option.state & QStyle.StateFlag.State_Selected: painter.fillRect(rect, option.palette.highlight())
+        if isinstance(pixmap := index.data(Qt.ItemDataRole.DecorationRole), QPixmap) and not pixmap.isNull():
+            painter.drawPixmap(rect.x() + (rect.width() - pixmap.width()) // 2, rect.y() + (rect.height() - pixmap.height()) // 2, pixmap)
+        else:
+            painter.fillRect(rect.adjusted(3, 3, -3, -3), QColor("#2b2b2b")); painter.setPen(QColor("#888888"))
+            painter.drawText(rect, Qt.AlignmentFlag.AlignCenter, index.data(Qt.ItemDataRole.DisplayRole) or "")
+        painter.restore()
+
+
+class CollectionListView(QListView):
+    """表示範囲のタイルだけを描画するサムネイル一覧 (ドラッグでの並べ替え・外部へのドラッグに対応)"""
+    reorder_requested = Signal(str, str)
+    files_dropped = Signal(list)
+    delete_requested = Signal(str)
+    open_requested = Signal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setViewMode(QListView.ViewMode.IconMode); self.setMovement(QListView.Movement.Static); self.setResizeMode(QListView.ResizeMode.Adjust)
+        self.setUniformItemSizes(True); self.setSpacing(5); self.setWrapping(True); self.setLayoutMode(QListView.LayoutMode.Batched); self.setBatchSize(200)
+        self.setSelectionMode(QListView.SelectionMode.SingleSelection); self.setFrameShape(QFrame.Shape.NoFrame)
+        self.setDragEnabled(True); self.setAcceptDrops(True); self.setDropIndicatorShown(False)
+        self.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu); self.customContextMenuRequested.connect(self.showContextMenu)
+        self.doubleClicked.connect(lambda index: self.open_requested.emit(index.data(Qt.ItemDataRole.UserRole)))
+    def startDrag(self, supportedActions):
+        if not (index := self.currentIndex()).isValid() or not os.path.exists(path := index.data(Qt.ItemDataRole.UserRole)): return
+        drag = QDrag(self); mime_data = QMimeData(); mime_data.setUrls([QUrl.fromLocalFile(os.path.abspath(path))])
+        mime_data.setData("application/x-imageviewer", QByteArray(path.encode())); mime_data.setData(CollectionModel.SORTABLE_MIME, QByteArray(path.encode())); drag.setMimeData(mime_data)
+        if isinstance(pixmap := index.data(Qt.ItemDataRole.DecorationRole), QPixmap) and not pixmap.isNull():
+            preview_pixmap = pixmap.scaled(100, 100, Qt.AspectRatioMode.KeepAspectRatio)
+            drag.setPixmap(preview_pixmap); drag.setHotSpot(QPoint(int(preview_pixmap.width() / 2), int(preview_pixmap.height() / 2)))
+        drag.exec(Qt.DropAction.CopyAction)
+    @staticmethod
+    def png_urls(mime_data): return [url.toLocalFile() for url in mime_data.urls() if url.isLocalFile() and url.toLocalFile().lower().endswith('.png')]
+    def dragEnterEvent(self, event: QDragEnterEvent):
+        if event.mimeData().hasFormat(CollectionModel.SORTABLE_MIME) or self.png_urls(event.mimeData()): event.acceptProposedAction()
+        else: event.ignore()
+    def dragMoveEvent(self, event): self.dragEnterEvent(event)
+    def dropEvent(self, event: QDropEvent):
+        mime_data = event.mimeData(); target = self.indexAt(event.position().toPoint())
+        if mime_data.hasFormat(CollectionModel.SORTABLE_MIME) and target.isValid() and (source_path := mime_data.data(CollectionModel.SORTABLE_MIME).data().decode()) in self.model():
+            self.reorder_requested.emit(source_path, target.data(Qt.ItemDataRole.UserRole)); event.acceptProposedAction(); return
+        if files := self.png_urls(mime_data): self.files_dropped.emit(files); event.acceptProposedAction(); return
+        event.ignore()
+    def showContextMenu(self, position):
+        if not (index := self.indexAt(position)).isValid(): return
+        context_menu = QMenu(self); delete_action = context_menu.addAction("削除"); delete_action.triggered.connect(lambda: self.delete_requested.emit(index.data(Qt.ItemDataRole.UserRole))); context_menu.exec(self.viewport().mapToGlobal(position))
 
 
 class CollectionWidget(QWidget):
     image_selected = Signal(str)
     def __init__(self, parent=None):
-        super().__init__(parent); self.images, self.thumbnails, self.thumbnail_map = [], [], {}; self.setMinimumWidth(170); self.init_ui()
+        super().__init__(parent); self.model = CollectionModel(130, self); self.images = self.model.images; self.setMinimumWidth(170); self.init_ui()
     def init_ui(self):
         self.main_layout = QVBoxLayout(self); toolbar_layout = QHBoxLayout()
         self.clear_button = QPushButton("クリア", self); self.clear_button.setFixedWidth(50); self.clear_button.clicked.connect(self.clear_collection); toolbar_layout.addWidget(self.clear_button)
@@ -564,40 +1127,30 @@ class CollectionWidget(QWidget):
         self.save_button = QPushButton("💾 保存", self); self.save_button.clicked.connect(self.save_collection); toolbar_layout.addWidget(self.save_button)
         self.load_button = QPushButton("📂 読込", self); self.load_button.clicked.connect(self.show_load_dialog); toolbar_layout.addWidget(self.load_button)
         toolbar_layout.addStretch(1); self.main_layout.addLayout(toolbar_layout)
-        self.scroll_area = QScrollArea(); self.scroll_area.setWidgetResizable(True); self.scroll_area.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded); self.scroll_area.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded); self.scroll_area.setFrameShape(QFrame.Shape.NoFrame)
-        self.scroll_content = QWidget(); self.flow_layout = FlowLayout(self.scroll_content); self.scroll_content.setLayout(self.flow_layout)
-        self.scroll_area.setWidget(self.scroll_content); self.main_layout.addWidget(self.scroll_area); self.setAcceptDrops(True)
-    def add_image(self, image_path):
-        if image_path in self.images or not os.path.exists(image_path): return
-        self.images.append(image_path); thumbnail = ViewerDraggableLabel(image_path, self); pixmap = QPixmap(image_path)
-        thumbnail.setPixmap(pixmap.scaled(thumbnail.thumbnail_size, thumbnail.thumbnail_size, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
-        thumbnail.setAlignment(Qt.AlignmentFlag.AlignCenter); thumbnail.deleteRequested.connect(self.remove_image)
-        self.thumbnails.append(thumbnail); self.thumbnail_map[image_path] = thumbnail; self.flow_layout.addWidget(thumbnail); self.flow_layout.update()
-    def remove_image(self, image_path):
-        if image_path in self.images:
-            self.images.remove(image_path)
-            if image_path in self.thumbnail_map:
-                thumbnail = self.thumbnail_map[image_path]; self.thumbnails.remove(thumbnail); del self.thumbnail_map[image_path]; thumbnail.setParent(None); self.flow_layout.update()
-    def swapImages(self, source_path, target_path):
-        if source_path in self.images and target_path in self.images:
-            source_image = self.images.pop(self.images.index(source_path)); self.images.insert(self.images.index(target_path), source_image)
-            for thumbnail in self.thumbnails: thumbnail.setParent(None)
-            for img_path in self.images:
-                if img_path in self.thumbnail_map: self.flow_layout.addWidget(self.thumbnail_map[img_path])
-            self.flow_layout.update()
-    def clear_collection(self):
-        for thumbnail in self.thumbnails: thumbnail.setParent(None)
-        self.thumbnails.clear(); self.images.clear(); self.flow_layout.update()
+        self.list_view = CollectionListView(self); self.list_view.setModel(self.model); self.list_view.setItemDelegate(CollectionItemDelegate(self.model.thumbnail_size, self.list_view))
+        self.list_view.reorder_requested.connect(self.swapImages); self.list_view.files_dropped.connect(self.add_images)
+        self.list_view.delete_requested.connect(self.remove_image); self.list_view.open_requested.connect(self.open_original)
+        self.main_layout.addWidget(self.list_view); self.setAcceptDrops(True)
+    def add_image(self, image_path): self.add_images([image_path])
+    def add_images(self, image_paths):
+        new_paths = []
+        for path in image_paths:
+            if path not in self.model and path not in new_paths and os.path.exists(path): new_paths.append(path)
+        self.model.append(new_paths)
+    def remove_image(self, image_path): self.model.remove(image_path)
+    def swapImages(self, source_path, target_path): self.model.move_before(source_path, target_path)
+    def clear_collection(self): self.model.clear()
+    def open_original(self, image_path):
+        if image_path and os.path.exists(image_path):
+            original_view = OriginalViewWindow(image_path); original_view.show()
+            if not hasattr(QApplication.instance(), "_original_windows"): QApplication.instance()._original_windows = []
+            QApplication.instance()._original_windows.append(original_view)
+            original_view.originalWindowClosed.connect(lambda w: QApplication.instance()._original_windows.remove(w) if w in QApplication.instance()._original_windows else None)
     def dragEnterEvent(self, event: QDragEnterEvent):
-        if event.mimeData().hasUrls():
-            for url in event.mimeData().urls():
-                if url.isLocalFile() and url.toLocalFile().lower().endswith('.png'): event.acceptProposedAction(); return
+        if CollectionListView.png_urls(event.mimeData()): event.acceptProposedAction(); return
         event.ignore()
     def dropEvent(self, event: QDropEvent):
-        if event.mimeData().hasUrls():
-            for url in event.mimeData().urls():
-                if url.isLocalFile() and url.toLocalFile().lower().endswith('.png'): self.add_image(url.toLocalFile())
-            event.acceptProposedAction()
+        if event.mimeData().hasUrls(): self.add_images(CollectionListView.png_urls(event.mimeData())); event.acceptProposedAction()
     def save_collection(self):
         if not self.images: QMessageBox.warning(self, "通知", "保存する画像がありません。"); return
         memo = self.text_box.text().strip() or "Untitled"; now = datetime.now(); timestamp = now.strftime("%Y/%m/%d %H:%M"); filename_ts = now.strftime("%Y%m%d_%H%M%S")
@@ -609,8 +1162,7 @@ class CollectionWidget(QWidget):
     def show_load_dialog(self):
         dialog = CollectionLoadDialog(self)
         if dialog.exec() and (selected_images := dialog.get_selected_images()):
-            self.clear_collection()
-            for img in selected_images: self.add_image(img)
+            self.clear_collection(); self.add_images(selected_images)
             if dialog.selected_memo: self.text_box.setText(dialog.selected_memo)
 
 
@@ -671,9 +1223,6 @@ class CollectionWindow(QMainWindow):
     def __init__(self, parent=None):
         super().__init__(parent); self.collection_widget = CollectionWidget(self); self.setCentralWidget(self.collection_widget); self.setWindowTitle("画像コレクション"); self.resize(700, 220)
     def add_image(self, image_path): self.collection_widget.add_image(image_path)
-    def resizeEvent(self, event):
-        if hasattr(self, 'collection_widget') and hasattr(self.collection_widget, 'flow_layout'): self.collection_widget.flow_layout.update()
-        super().resizeEvent(event)
     def closeEvent(self, event):
         if self.parent() and hasattr(self.parent(), 'remove_collection'): self.parent().remove_collection(self)
         super().closeEvent(event)
@@ -686,7 +1235,7 @@ class OriginalViewWindow(QMainWindow):
         self.image_label = QLabel(); self.image_label.setAlignment(Qt.AlignmentFlag.AlignCenter); self.image_label.setMouseTracking(True); self.image_label.mouseDoubleClickEvent = lambda e: self.close()
         self.scroll_area = QScrollArea(); self.scroll_area.setWidget(self.image_label); self.scroll_area.setWidgetResizable(True); self.scroll_area.setFrameShape(QFrame.Shape.NoFrame); self.layout.addWidget(self.scroll_area)
         self.dragging, self.drag_position = False, None
-        pixmap = QPixmap(image_file); self.image_label.setPixmap(pixmap); self.resize_window_to_image(pixmap)
+        pixmap = PIXMAP_CACHE.get(image_file); self.image_label.setPixmap(pixmap); self.resize_window_to_image(pixmap)
     def resize_window_to_image(self, pixmap):
         screen_size = QGuiApplication.primaryScreen().availableGeometry().size()
         self.resize(min(pixmap.width(), int(screen_size.width() * 0.85)) + 40, min(pixmap.height(), int(screen_size.height() * 0.85)) + 30)
@@ -702,6 +1251,207 @@ class OriginalViewWindow(QMainWindow):
     def closeEvent(self, event): self.originalWindowClosed.emit(self); super().closeEvent(event)
 
 
+# =====================================================================
+# フォルダモデル （一覧と stat 結果のキャッシュ＋フォルダ監視）
+# =====================================================================
+
+class FolderModel(QObject):
+    """フォルダ内の PNG 一覧を os.scandir で一度だけ取得し、stat 結果と
+    日付順・名前順の並びを保持する。以降は QFileSystemWatcher の通知で差分更新する。
+    recursive=True (ライブラリモード) ではサブフォルダも含め、ルートからの相対パスを名前として扱う。"""
+    changed = Signal()
+    SORT_KEYS = (lambda st, name: (st.st_mtime, name), lambda st, name: (name.lower(), name))  # 0: 日付順, 1: 名前順
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.folder, self.recursive, self.stats, self._sorted, self.generation = "", False, {}, {}, 0  # generation は一覧が変わるたびに増える
+        self.watcher = QFileSystemWatcher(self); self.watcher.directoryChanged.connect(self.on_directory_changed)
+
+    def set_folder(self, folder: str, recursive: bool = False):
+        if self.watcher.directories(): self.watcher.removePaths(self.watcher.directories())
+        self.folder, self.recursive, self.stats, self._sorted = folder, recursive, {}, {}; self.generation += 1
+        if not folder or not os.path.isdir(folder): return
+        self.stats, dirs = self._scan(folder, "")
+        self.watcher.addPaths([folder] + dirs)
+
+    def _scan(self, path: str, prefix: str) -> tuple[dict, list[str]]:
+        """path 以下の PNG を {相対パス: stat} で返す (recursive ならサブフォルダも辿り、見つけたフォルダも返す)"""
+        stats, dirs, pending = {}, [], [(path, prefix)]
+        while pending:
+            path, prefix = pending.pop()
+            try:
+                with os.scandir(path) as it:
+                    for e in it:
+                        if e.name.lower().endswith('.png') and e.is_file(): stats[os.path.join(prefix, e.name)] = e.stat()
+                        elif self.recursive and e.is_dir(follow_symlinks=False): dirs.append(e.path); pending.append((e.path, os.path.join(prefix, e.name)))
+            except OSError: pass
+        return stats, dirs
+
+    def files(self, sort_mode: int) -> list[str]:
+        """並び替え済みのファイル名リスト (内部リストそのものなので変更しないこと)"""
+        if (files := self._sorted.get(sort_mode)) is None:
+            key = self.SORT_KEYS[sort_mode]
+            files = self._sorted[sort_mode] = sorted(self.stats, key=lambda f: key(self.stats[f], f))
+        return files
+
+    def on_directory_changed(self, path: str):
+        if not os.path.isdir(self.folder): self.set_folder(self.folder, self.recursive); self.changed.emit(); return
+        prefix = os.path.relpath(path, self.folder) if self.recursive else os.curdir
+        prefix = "" if prefix == os.curdir else prefix
+        if not os.path.isdir(path):  # サブフォルダごと消えた
+            removed, added = [name for name in self.stats if name.startswith(prefix + os.sep)], {}
+        else:
+            # 変化のあったフォルダだけを見て、追加・削除を反映する。書き換えられた (サイズか更新時刻が変わった) ファイルは、
+            # scandir の結果に stat が含まれていて追加の呼び出しがかからない Windows (書き換えも通知される) でだけ拾い直す
+            with os.scandir(path) as it: current = {os.path.join(prefix, e.name): e for e in it if e.name.lower().endswith('.png') or self.recursive}
+            removed = [name for name in self.stats if os.path.dirname(name) == prefix and name not in current]
+            added, watched = {}, set(self.watcher.directories())
+            for name, entry in current.items():
+                if (old := self.stats.get(name)) is not None and os.name != "nt": continue
+                try:
+                    if old is not None:
+                        if (st := entry.stat()).st_size != old.st_size or st.st_mtime_ns != old.st_mtime_ns: removed.append(name); added[name] = st  # 並びを入れ直す
+                    elif entry.name.lower().endswith('.png') and entry.is_file(): added[name] = entry.stat()
+                    elif entry.is_dir(follow_symlinks=False) and entry.path not in watched:  # 新しいサブフォルダ (日付フォルダなど)
+                        stats, dirs = self._scan(entry.path, name); added.update(stats); self.watcher.addPaths([entry.path] + dirs)
+                except OSError: pass
+        if not (added or removed): return
+        for name in removed: del self.stats[name]
+        self.stats.update(added); gone = set(removed)
+        for sort_mode, files in self._sorted.items():
+            key = self.SORT_KEYS[sort_mode]
+            if gone: files[:] = [f for f in files if f not in gone]
+            for name in added: bisect.insort(files, name, key=lambda f: key(self.stats[f], f))
+        self.generation += 1; self.changed.emit()
+
+
+class FilteredFiles:
+    """フィルタ・並び替え済みのファイル一覧。フォルダやクエリが変わるまで使い回し、
+    名前からの位置の検索を O(1) で行う (list と同じように扱える)。"""
+    def __init__(self, files: list[str]): self.files, self._positions = files, None
+    def __len__(self): return len(self.files)
+    def __bool__(self): return bool(self.files)
+    def __iter__(self): return iter(self.files)
+    def __getitem__(self, i): return self.files[i]
+    def _index_map(self) -> dict:
+        if self._positions is None: self._positions = {name: i for i, name in enumerate(self.files)}
+        return self._positions
+    def __contains__(self, name): return name in self._index_map()
+    def index(self, name): return self._index_map()[name]
+    def copy(self) -> list[str]: return list(self.files)
+
+
+# =====================================================================
+# 画像の先読み （ホイールの進行方向にある画像をバックグラウンドでデコード）
+# =====================================================================
+
+class _DecodeSignals(QObject):
+    decoded = Signal(str, object, object)  # path, mtime_ns, QImage
+
+class _DecodeTask(QRunnable):
+    def __init__(self, path: str, signals: _DecodeSignals):
+        super().__init__(); self.path, self.signals = path, signals
+    def run(self):
+        try: mtime_ns = os.stat(self.path).st_mtime_ns
+        except OSError: return
+        reader = QImageReader(self.path); reader.setAutoTransform(True); image = reader.read()
+        if not image.isNull(): self.signals.decoded.emit(self.path, mtime_ns, image)
+
+class ImagePrefetcher(QObject):
+    """QImageReader でデコードした QImage を、メモリ上限付きの LRU で保持する先読みキャッシュ"""
+
+    def __init__(self, count=PREFETCH_COUNT, budget_mb=PREFETCH_BUDGET_MB, parent=None):
+        super().__init__(parent)
+        self.count, self.budget = count, budget_mb * 1024 * 1024
+        self.hits, self.misses, self.total_bytes = 0, 0, 0
+        self._cache, self._queued = OrderedDict(), set()  # path -> (mtime_ns, QImage)
+        self.pool = QThreadPool(self); self.pool.setMaxThreadCount(2)
+        self.signals = _DecodeSignals(self); self.signals.decoded.connect(self.on_decoded)
+
+    def take(self, path: str):
+        """先読み済みならその QImage を返す (無ければ None)"""
+        if (cached := self._cache.get(path)) is not None:
+            try: fresh = os.stat(path).st_mtime_ns == cached[0]
+            except OSError: fresh = False
+            self._evict(path)  # 取り出した画像は共有キャッシュ側で保持するので二重に持たない
+            if fresh: self.hits += 1; return cached[1]
+        self.misses += 1
+        return None
+
+    def prefetch(self, files: list[str], folder: str, index: int, step: int):
+        """files[index] から step 方向に count 枚を先読みする (古い方向の未着手分は破棄する)"""
+        if not files or self.count <= 0: return
+        self.pool.clear(); self._queued.clear()
+        for i in range(1, min(self.count, len(files) - 1) + 1):
+            path = os.path.join(folder, files[(index + step * i) % len(files)])
+            if path in self._cache or path in self._queued or path in PIXMAP_CACHE: continue
+            self._queued.add(path); self.pool.start(_DecodeTask(path, self.signals))
+
+    def on_decoded(self, path: str, mtime_ns: int, image: QImage):
+        self._queued.discard(path)
+        if (size := image.sizeInBytes()) > self.budget: return
+        self._evict(path); self._cache[path] = (mtime_ns, image); self.total_bytes += size
+        while self.total_bytes > self.budget: self._evict(next(iter(self._cache)))
+
+    def _evict(self, path: str):
+        if (cached := self._cache.pop(path, None)) is not None: self.total_bytes -= cached[1].sizeInBytes()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "images": len(self._cache), "bytes": self.total_bytes}
+
+
+# =====================================================================
+# 並列フィルタスキャン （未インデックスのフォルダをプロセスプールで解析）
+# =====================================================================
+
+class FilterScanner(QObject):
+    """未解析のファイルを ProcessPoolExecutor で分割して解析し、フィルタに一致したファイルを見つけ次第通知する。
+    解析結果はチャンクごとにインデックスへ登録するので、途中でキャンセルしても無駄にならない。"""
+    _chunk_done = Signal(int, object)  # token, Future (ワーカーの完了コールバックから GUI スレッドへ渡す)
+    match_found = Signal(str)
+    progress = Signal(int, int)
+    finished = Signal(bool)
+    _executor = None
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.token, self.futures, self.folder, self.query, self.done, self.total, self.matched = 0, {}, "", None, 0, 0, False
+        self._chunk_done.connect(self.on_chunk_done)
+
+    @classmethod
+    def executor(cls) -> ProcessPoolExecutor:
+        # Qt のスレッドを抱えたまま fork しないよう、どの OS でも spawn で起動する
+        if cls._executor is None: cls._executor = ProcessPoolExecutor(max_workers=SCAN_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return cls._executor
+
+    def is_running(self) -> bool: return bool(self.futures)
+
+    def start(self, folder: str, names: list[str], query: FilterQuery | None):
+        """names を先頭から順にチャンクへ分けて投入する (先頭側ほど早く結果が返る)。query が None なら索引付けだけを行う"""
+        self.cancel(); token = self.token
+        self.folder, self.query, self.done, self.total, self.matched = folder, query, 0, len(names), False
+        for i in range(0, len(names), SCAN_CHUNK):
+            chunk = names[i:i + SCAN_CHUNK]
+            future = self.executor().submit(scan_files, folder, chunk, query); self.futures[future] = len(chunk)
+            future.add_done_callback(lambda f, t=token: self._chunk_done.emit(t, f))
+
+    def cancel(self):
+        # 未着手の future を cancel すると完了コールバックがその場で呼ばれるので、先に辞書と token を差し替えてから止める
+        futures, self.futures = self.futures, {}; self.token += 1  # 実行中のチャンクの結果は token の不一致で捨てられる
+        for future in futures: future.cancel()
+
+    def on_chunk_done(self, token, future):
+        if token != self.token or future not in self.futures: return
+        self.done += self.futures.pop(future)
+        try: results = future.result()
+        except Exception: results = []
+        METADATA_INDEX.update_entries(self.folder, [r[:4] for r in results])
+        for name, *_, matched in results:
+            if matched: self.matched = True; self.match_found.emit(name)
+        self.progress.emit(self.done, self.total)
+        if not self.futures: self.finished.emit(self.matched)
+
+
 # =====================================================================
 # ImageView （単体/左右比較のビューア）
 # =====================================================================
@@ -740,6 +1490,12 @@ class ImageView(QWidget):
         self.toolbar = self.setup_toolbar(); layout.insertLayout(0, self.toolbar)
         self.image_label.installEventFilter(self); self.container.setAcceptDrops(True); self.container.installEventFilter(self)
         self.open_button.new_folder.connect(self.on_new_folder); self.original_views = [] 
+        self.folder_model = FolderModel(self); self.folder_model.changed.connect(self.on_folder_changed)
+        self._filtered_cache = {}  # apply_filter -> (キー, FilteredFiles)
+        self.prefetcher = ImagePrefetcher(parent=self)
+        self.scanner = FilterScanner(self); self.scan_displayed = False
+        self.scanner.match_found.connect(self.on_scan_match); self.scanner.progress.connect(self.on_scan_progress); self.scanner.finished.connect(self.on_scan_finished)
+        self.text_box.textChanged.connect(self.scanner.cancel)  # 入力し直したら古い検索は打ち切る
 
     def setup_toolbar(self):
         toolbar = QHBoxLayout()
@@ -756,6 +1512,7 @@ class ImageView(QWidget):
         self.text_box = QLineEdit()
         self.text_box.setMinimumWidth(80)
         self.text_box.setPlaceholderText("Filter ( - : neg prompt)")
+        self.text_box.setToolTip("タグ検索: a, b (AND)  a | b (OR)  !a (NOT)  a* (前方一致)  neg:a (ネガティブ側)\n先頭の - : ネガティブプロンプトを対象  re: : 正規表現で検索")
         self.text_box.setClearButtonEnabled(True)
         self.text_box.editingFinished.connect(self.text_entered)
         toolbar.addWidget(self.text_box)
@@ -786,27 +1543,52 @@ class ImageView(QWidget):
 
         return toolbar    
 
+    @traced()
     def get_sorted_image_files(self, apply_filter=False):
-        if not self.current_folder or not os.path.exists(self.current_folder): return []
-        files = [f for f in os.listdir(self.current_folder) if f.lower().endswith('.png')]
-        if apply_filter and self.text_box.text().strip():
-            query = self.text_box.text().strip(); is_neg = query.startswith("-"); pattern_str = query[1:].strip() if is_neg else query
-            if pattern_str:
-                try:
-                    regex = re.compile(pattern_str, re.IGNORECASE)
-                    files = [f for f in files if regex.search(self.extract_png_metadata(os.path.join(self.current_folder, f)).get("Negative prompt" if is_neg else "Prompt", ""))]
-                except re.error: pass
-        #files.sort(key=lambda f: os.path.getmtime(os.path.join(self.current_folder, f)) if self.combo_sort.currentIndex() == 0 else f.lower(), reverse=self.chk_desc.isChecked())
-        files.sort(key=lambda f: os.path.getmtime(os.path.join(self.current_folder, f)) if self.combo_sort.currentIndex() == 0 else f.lower(), reverse=False)
-        return files
+        """並び替え (とフィルタ) 済みの FilteredFiles を返す。
+        (フォルダの世代, インデックスの版, 並び順, クエリ) が変わらない限り前回の結果を使い回す。"""
+        if not self.current_folder or not os.path.exists(self.current_folder): return FilteredFiles([])
+        self.sync_folder_model()
+        query = self.filter_query() if apply_filter else None
+        key = self.filtered_key(query)
+        if (cached := self._filtered_cache.get(apply_filter)) and cached[0] == key: return cached[1]
+        files = self.folder_model.files(self.combo_sort.currentIndex())
+        if query:
+            # インデックス済みのフォルダでは PNG を開かずに (タグ検索なら転置インデックスだけで) フィルタできる
+            matched = METADATA_INDEX.matching_names(self.current_folder, query, self.folder_model.stats, parse=not self.scanner.is_running())
+            files = [f for f in files if f in matched]
+            key = self.filtered_key(query)  # 解析でインデックスが更新された場合は更新後の版で覚える
+        result = FilteredFiles(files); self._filtered_cache[apply_filter] = (key, result)
+        return result
+
+    def sync_folder_model(self):
+        if (self.folder_model.folder, self.folder_model.recursive) != (self.current_folder, self.open_button.library_mode):
+            self.folder_model.set_folder(self.current_folder, self.open_button.library_mode)
+
+    def relative_name(self, image_path: str) -> str:
+        """一覧上の名前 (ライブラリモードではルートからの相対パス)"""
+        if not self.open_button.library_mode: return os.path.basename(image_path)
+        try: return os.path.relpath(image_path, self.current_folder)
+        except ValueError: return image_path  # Windows で別ドライブの場合 (一覧には含まれない)
+
+    def filtered_key(self, query):
+        return (self.current_folder, self.folder_model.generation, METADATA_INDEX.version, self.combo_sort.currentIndex(), query.text if query else None)
+
+    def has_filtered_match(self) -> bool:
+        """フィルタ結果が 1 件以上あるかを調べる (正規表現で結果が未計算なら最初の一致が見つかった時点で打ち切る)"""
+        if not (query := self.filter_query()) or query.is_tag_query: return bool(self.get_sorted_image_files(apply_filter=True))
+        if (cached := self._filtered_cache.get(True)) and cached[0] == self.filtered_key(query): return bool(cached[1])
+        if not self.current_folder or not os.path.exists(self.current_folder): return False
+        self.sync_folder_model()
+        metas = METADATA_INDEX.folder_metadata(self.current_folder, self.folder_model.stats, parse=not self.scanner.is_running())
+        return any(query.matches(meta) for meta in metas.values())
 
 
     # 追加：チェックボックスの有効/無効を更新するメソッド
     def update_highlight_checkbox_state(self):
         query = self.text_box.text().strip()
-        files = self.get_sorted_image_files(apply_filter=True)
         # 検索ワードが存在し、フィルタ結果にファイルが1つ以上ある場合のみ有効化
-        if query and len(files) > 0:
+        if query and self.has_filtered_match():
             self.chk_highlight.setEnabled(True)
         else:
             self.chk_highlight.setChecked(False)
@@ -821,7 +1603,7 @@ class ImageView(QWidget):
     def refresh_folder_view(self):
         files = self.get_sorted_image_files(True)
         if files:
-            current_name = os.path.basename(self.current_image_path)
+            current_name = self.relative_name(self.current_image_path)
             if current_name in files:
                 self.current_index = files.index(current_name)
             else:
@@ -832,6 +1614,13 @@ class ImageView(QWidget):
         # 追加
         self.update_highlight_checkbox_state()
 
+    def on_folder_changed(self):
+        """監視中のフォルダでファイルが追加・削除されたときに表示位置と件数を更新する"""
+        if not self.current_image_path: return
+        files = self.get_sorted_image_files(apply_filter=True); current_name = self.relative_name(self.current_image_path)
+        if current_name in files: self.current_index = files.index(current_name)
+        self.update_page_display(len(files))
+
     def update_page_display(self, total_files=None):
         #if total_files is None: total_files = len(self.get_sorted_image_files(apply_filter=self.slider_popup.chk_filter.isChecked()))
         if total_files is None: total_files = len(self.get_sorted_image_files(apply_filter=True))
@@ -870,7 +1659,7 @@ class ImageView(QWidget):
         self.slider_popup.slider.setMaximum(len(image_files) - 1)
         self.slider_popup.image_files = image_files.copy()
 
-        current_name = os.path.basename(self.current_image_path)
+        current_name = self.relative_name(self.current_image_path)
         if current_name in image_files:
             self.current_index = image_files.index(current_name)
         self.slider_popup.slider.setValue(self.current_index)
@@ -890,20 +1679,27 @@ class ImageView(QWidget):
             if checkbox.text() in self.meta_tags: checkbox.setChecked(True)
         if dialog.exec(): self.meta_tags = dialog.getSelectedItems(); self.display_metadata(self.metadata); self.image_loaded.emit()
 
-    def on_new_folder(self): self.current_folder = self.open_button.current_folder; self.current_index = 0; self.load_first_image(); self.image_loaded.emit()
+    def on_new_folder(self): self.scanner.cancel(); self.current_folder = self.open_button.current_folder; self.current_index = 0; self.load_first_image(); self.start_background_index(); self.image_loaded.emit()
     def load_first_image(self):
+        # 未解析のファイルが多いフォルダでフィルタ中なら、並列スキャンで最初の一致を探す
+        if (query := self.filter_query()) and (files := self.get_sorted_image_files(apply_filter=False)):
+            if self.start_parallel_search(files, 0, query): return
         #if image_files := self.get_sorted_image_files(apply_filter=self.slider_popup.chk_filter.isChecked()): self.load_image(os.path.join(self.current_folder, image_files[0]))
         if image_files := self.get_sorted_image_files(apply_filter=True): self.load_image(os.path.join(self.current_folder, image_files[0]))
         else: self.clear_view_area("No matching png files found")
 
+    @traced()
     def load_image(self, image_path):
-        pixmap = QPixmap(image_path)
+        with TRACER.span("decode"):
+            if (pixmap := PIXMAP_CACHE.lookup(image_path)) is None:
+                image = self.prefetcher.take(image_path)
+                pixmap = PIXMAP_CACHE.put(image_path, QPixmap.fromImage(image) if image is not None else QPixmap(image_path))
         if not pixmap.isNull():
-            self.image_label.setPixmap(pixmap.scaled(self.image_label.size(), Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
+            with TRACER.span("scale"): self.image_label.setPixmap(PIXMAP_CACHE.scaled(image_path, self.image_label.width(), self.image_label.height(), source=pixmap))
             self.current_image_path, self.image_label.image_path = image_path, image_path
             #files = self.get_sorted_image_files(apply_filter=self.slider_popup.chk_filter.isChecked())
             files = self.get_sorted_image_files(apply_filter=True)
-            if os.path.basename(image_path) in files: self.current_index = files.index(os.path.basename(image_path))
+            if (name := self.relative_name(image_path)) in files: self.current_index = files.index(name)
             self.update_page_display(len(files)); metadata = self.extract_png_metadata(image_path); self.display_metadata(metadata); self.metadata = metadata
         self.image_loaded.emit()
 
@@ -915,6 +1711,7 @@ class ImageView(QWidget):
             if child.widget(): child.widget().deleteLater()
         self.lbl_page.setText("0/0")
 
+    @traced()
     def change_image(self, event):
         if not self.current_folder:
             return
@@ -922,28 +1719,16 @@ class ImageView(QWidget):
         if not (files := self.get_sorted_image_files(apply_filter=True)):
             return
 
-        current_idx = files.index(os.path.basename(self.current_image_path)) if os.path.basename(self.current_image_path) in files else 0
-        new_idx = (current_idx + (-1 if event.angleDelta().y() > 0 else 1)) % len(files)
-        if self.text_box.text().strip():
-            query = self.text_box.text().strip()
-            is_neg = query.startswith("-")
-            pattern_str = query[1:].strip() if is_neg else query
-            if pattern_str:
-                try:
-                    regex = re.compile(pattern_str, re.IGNORECASE)
-                    for _ in range(len(files)):
-                        if regex.search(self.extract_png_metadata(os.path.join(self.current_folder, files[new_idx])).get("Negative prompt" if is_neg else "Prompt", "")):
-                            self.load_image(os.path.join(self.current_folder, files[new_idx]))
-                            self.refresh_folder_view(); return
-                        new_idx = (new_idx + (-1 if event.angleDelta().y() > 0 else 1)) % len(files)
-                    return
-                except re.error: pass
-        else:
-            self.update_highlight_checkbox_state()
+        current_name = self.relative_name(self.current_image_path)
+        current_idx = files.index(current_name) if current_name in files else 0
+        step = -1 if event.angleDelta().y() > 0 else 1
+        new_idx = (current_idx + step) % len(files)
+        # files はフィルタ適用済みなので、隣の画像をそのまま表示すればよい
         self.load_image(os.path.join(self.current_folder, files[new_idx]))
-#        if not self.text_box.text().strip():
-#            self.refresh_folder_view()
+        self.update_highlight_checkbox_state()
+        self.prefetcher.prefetch(files, self.current_folder, new_idx, step)
 
+    @traced()
     def text_entered(self):
         if not self.current_folder:
             return
@@ -952,74 +1737,79 @@ class ImageView(QWidget):
         if not files:
             return
             
-        current_name = os.path.basename(self.current_image_path)
+        current_name = self.relative_name(self.current_image_path)
         current_idx = files.index(current_name) if current_name in files else 0
         
-        query = self.text_box.text().strip()
-        if not query:
+        if not self.text_box.text().strip():
             self.refresh_folder_view()
             self.update_highlight_checkbox_state() # ★追加
+            self.start_background_index()
             return
             
-        is_neg = query.startswith("-")
-        pattern_str = query[1:].strip() if is_neg else query
-        
-        if pattern_str:
-            try:
-                regex = re.compile(pattern_str, re.IGNORECASE)
-                match_found = False
-                for _ in range(len(files)):
-                    meta = self.extract_png_metadata(os.path.join(self.current_folder, files[current_idx]))
-                    target_prompt = meta.get("Negative prompt" if is_neg else "Prompt", "")
-                    
-                    if regex.search(target_prompt):
-                        self.load_image(os.path.join(self.current_folder, files[current_idx]))
-                        self.refresh_folder_view()
-                        match_found = True
-                        break
-                        
-                    current_idx = (current_idx + 1) % len(files)
+        if query := self.filter_query():
+            if self.start_parallel_search(files, current_idx, query): return
+            matched = METADATA_INDEX.matching_names(self.current_folder, query, self.folder_model.stats)
+            match_found = False
+            for _ in range(len(files)):
+                if files[current_idx] in matched:
+                    self.load_image(os.path.join(self.current_folder, files[current_idx]))
+                    self.refresh_folder_view()
+                    match_found = True
+                    break
                     
-                if not match_found:
-                    self.clear_view_area("No matching images found")
-            except re.error:
-                pass
+                current_idx = (current_idx + 1) % len(files)
+                
+            if not match_found:
+                self.clear_view_area("No matching images found")
                 
         self.update_highlight_checkbox_state() # ★追加
 
-    def parse_metadata(self, text):
-        metadata = {}; neg_prompt_index = text.find("Negative prompt:")
-        if neg_prompt_index == -1: neg_prompt_index = text.find("Steps:")
-        if neg_prompt_index != -1:
-            metadata["Prompt"] = text[:neg_prompt_index].strip(); remaining_text = text[neg_prompt_index:]; steps_index = remaining_text.find("Steps:")
-            metadata["Negative prompt"] = remaining_text[:steps_index].replace("Negative prompt:", "").strip()
-            for param in remaining_text[steps_index:].split(","):
-                if ":" in param: key, value = param.split(":", 1); metadata[key.strip()] = value.strip()
-        return metadata
-
-    def extract_comfy_metadata(self, value):
-        try:
-            metadata = json.loads(value); prompt, others, prompt_tags, text_id = {}, {}, ["Prompt", "Negative prompt"], 0
-            for values in metadata.values():
-                inputs = values.get("inputs", {})
-                if values.get("class_type") == "CLIPTextEncode":
-                    if "text" in inputs and text_id < len(prompt_tags): prompt[prompt_tags[text_id]] = str(inputs["text"]); text_id += 1
-                else:
-                    for k, v in inputs.items(): others[k] = str(v)
-            return prompt | others
-        except Exception: return {}
+    def filter_query(self):
+        """フィルタ欄の内容を FilterQuery として返す (空や不正な正規表現なら None)"""
+        return FilterQuery.parse(self.text_box.text())
+
+    def start_parallel_search(self, files, start_idx, query):
+        """未解析のファイルが多ければ並列スキャンを開始して True を返す。
+        インデックス済みの一致があればすぐに表示し、無ければ最初に見つかった一致を表示する。"""
+        stale = METADATA_INDEX.stale_names(self.current_folder, self.folder_model.stats)
+        if len(stale) < PARALLEL_SCAN_THRESHOLD: return False
+        order = {name: i for i, name in enumerate(files[start_idx:] + files[:start_idx])}
+        stale.sort(key=lambda name: order.get(name, len(order)))
+        self.scan_displayed = False; self.scanner.start(self.current_folder, stale, query)
+        matched = METADATA_INDEX.matching_names(self.current_folder, query, self.folder_model.stats, parse=False)
+        for i in range(len(files)):
+            name = files[(start_idx + i) % len(files)]
+            if name in matched:
+                self.scan_displayed = True; self.load_image(os.path.join(self.current_folder, name)); break
+        self.on_scan_progress(0, len(stale))
+        return True
+
+    def start_background_index(self):
+        """ライブラリモードでは未解析のファイルを先にバックグラウンドで索引付けしておく (フィルタ時に待たずに済む)"""
+        if not self.open_button.library_mode or not self.current_folder or self.scanner.is_running(): return
+        self.sync_folder_model()
+        if stale := METADATA_INDEX.stale_names(self.current_folder, self.folder_model.stats):
+            self.scan_displayed = True; self.scanner.start(self.current_folder, stale, None); self.on_scan_progress(0, len(stale))
+
+    def on_scan_match(self, name):
+        if self.scan_displayed or self.scanner.folder != self.current_folder: return
+        self.scan_displayed = True; self.load_image(os.path.join(self.current_folder, name))
+
+    def on_scan_progress(self, done, total): self.lbl_page.setText(f"{'🔍' if self.scanner.query else '📚'} {done}/{total}")
+
+    def on_scan_finished(self, matched):
+        if self.scanner.folder != self.current_folder: return
+        if self.scanner.query and not self.scan_displayed: self.clear_view_area("No matching images found")
+        else: self.refresh_folder_view()
+        self.update_highlight_checkbox_state()
 
-    def extract_png_metadata(self, image_path):
-        try:
-            with Image.open(image_path) as img:
-                if isinstance(img, PngImageFile):
-                    for key, value in img.info.items():
-                        if key.lower() == 'parameters': return self.parse_metadata(value)
-                        elif key.lower() == 'prompt': return self.extract_comfy_metadata(value)
-        except Exception: pass
-        return {}
+    def parse_metadata(self, text): return parse_metadata(text)
+    def extract_comfy_metadata(self, value): return extract_comfy_metadata(value)
+    @traced()
+    def extract_png_metadata(self, image_path): return METADATA_INDEX.get(image_path)
             
     # 既存の display_metadata を修正し、ハイライト処理を追加
+    @traced()
     def display_metadata(self, metadata, clear=True):
         if clear:
             while child := self.metadata_layout.takeAt(0):
@@ -1027,12 +1817,7 @@ class ImageView(QWidget):
                     child.widget().deleteLater()
                     
         # ★追加：ハイライトするワードの判定
-        highlight_word = ""
-        is_neg = False
-        if self.chk_highlight.isChecked():
-            query = self.text_box.text().strip()
-            is_neg = query.startswith("-")
-            highlight_word = query[1:].strip() if is_neg else query
+        query = self.filter_query() if self.chk_highlight.isChecked() else None
 
         for key in self.meta_tags:
             if key in metadata:
@@ -1045,10 +1830,9 @@ class ImageView(QWidget):
                 label.send_all_to_forge.connect(lambda auto, m=metadata: self.send_all_to_forge.emit(m, auto))
                 
                 # ★追加：チェックが入っている場合、該当のプロンプトをハイライト
-                if highlight_word:
-                    target_key = "Negative prompt" if is_neg else "Prompt"
-                    if key == target_key:
-                        label.apply_highlight([highlight_word], "#ff99ff")
+                if query:
+                    if key == query.target_key:
+                        label.apply_highlight(query.highlight_words, "#ff99ff")
 
         self.metadata_layout.insertWidget(0, MetadataLabel("File", self.current_image_path.replace("\\", "/")))
         self.metadata_layout.addStretch()
@@ -1068,7 +1852,11 @@ class ImageView(QWidget):
     
     def dropped_image(self, event):
         if (files := [u.toLocalFile() for u in event.mimeData().urls()]) and os.path.isfile(files[0]) and files[0].lower().endswith('.png'):
-            self.current_folder = os.path.dirname(files[0]); self.open_button.current_folder = self.current_folder; self.load_image(files[0])
+            self.scanner.cancel()
+            # ライブラリの外のファイルなら通常のフォルダ表示に戻す
+            if not self.open_button.library_mode or (name := self.relative_name(files[0])).startswith(os.pardir) or os.path.isabs(name):
+                self.open_button.set_library_mode(False, reload=False); self.current_folder = os.path.dirname(files[0]); self.open_button.current_folder = self.current_folder
+            self.load_image(files[0])
 
     def on_image_double_click(self, event):
         if self.current_image_path and os.path.exists(self.current_image_path):
@@ -1089,9 +1877,8 @@ class ForgeClientPanel(QWidget):
         self.thread = None
         self.shortcuts = []
         self.init_ui()
-        self.load_models()
-        self.progress_timer = QTimer(self)
-        self.progress_timer.timeout.connect(self.check_forge_progress)
+        self.load_models(retries=0)  # 起動時は Forge を使わない (ビューアだけの) 場合も多いので、つながらなければすぐに諦める
+        TELEMETRY.progress_updated.connect(self.on_forge_progress)  # 進捗と CPU 温度は生成スレッドの実行中だけ取得される
 
     def init_ui(self):
         main_layout = QVBoxLayout(self)
@@ -1139,6 +1926,7 @@ class ForgeClientPanel(QWidget):
         prompt_layout = QVBoxLayout(prompt_group)
         prompt_layout.addWidget(QLabel("Prompt:")); self.txt_prompt = PromptTextEdit(); self.txt_prompt.setFont(QFont("Segoe UI", 10)); prompt_layout.addWidget(self.txt_prompt)
         prompt_layout.addWidget(QLabel("Negative Prompt:")); self.txt_neg_prompt = PromptTextEdit(); self.txt_neg_prompt.setFont(QFont("Segoe UI", 10)); prompt_layout.addWidget(self.txt_neg_prompt)
+        self.lbl_combinations = QLabel(); self.lbl_combinations.setStyleSheet("color: gray;"); prompt_layout.addWidget(self.lbl_combinations)
         bottom_layout.addWidget(prompt_group)
         #bottom_splitter.addWidget(prompt_group)
 
@@ -1166,7 +1954,7 @@ class ForgeClientPanel(QWidget):
         top_group = QGroupBox("3. 保存先 ＆ モデル (Checkpoint)"); top_g_layout = QVBoxLayout(top_group)
         dir_layout = QHBoxLayout(); dir_layout.addWidget(QLabel("保存:")); self.edit_out_dir = QLineEdit(os.path.abspath(DEFAULT_OUTPUT_DIR))
         btn_browse_dir = QPushButton("📁"); btn_browse_dir.setFixedWidth(35); btn_browse_dir.clicked.connect(self.browse_output_dir); dir_layout.addWidget(self.edit_out_dir); dir_layout.addWidget(btn_browse_dir); top_g_layout.addLayout(dir_layout)
-        model_layout = QHBoxLayout(); self.combo_model = NoWheelComboBox(); btn_refresh_models = QPushButton("🔄"); btn_refresh_models.setFixedWidth(35); btn_refresh_models.clicked.connect(self.load_models)
+        model_layout = QHBoxLayout(); self.combo_model = NoWheelComboBox(); btn_refresh_models = QPushButton("🔄"); btn_refresh_models.setFixedWidth(35); btn_refresh_models.clicked.connect(lambda: self.load_models())
         model_layout.addWidget(self.combo_model, stretch=1); model_layout.addWidget(btn_refresh_models); top_g_layout.addLayout(model_layout)
 
         bottom_layout.addWidget(top_group)
@@ -1177,11 +1965,17 @@ class ForgeClientPanel(QWidget):
         monitor_layout.addWidget(QLabel("上限温度:"), 0, 2); self.spin_temp = NoWheelDoubleSpinBox(); self.spin_temp.setRange(30.0, 100.0); self.spin_temp.setValue(50.0); monitor_layout.addWidget(self.spin_temp, 0, 3)
         self.chk_fixed_seed = QCheckBox("Fixed seed (組合せ時固定)"); self.chk_fixed_seed.setChecked(True); monitor_layout.addWidget(self.chk_fixed_seed, 1, 0, 1, 2)
         self.chk_forever = QCheckBox("∞ 無限ループ生成"); self.chk_forever.setStyleSheet("color: #FF9800; font-weight: bold;"); monitor_layout.addWidget(self.chk_forever, 1, 2, 1, 2)
+        self.chk_skip_existing = QCheckBox("生成済みの組み合わせはスキップ"); self.chk_skip_existing.setToolTip("保存先に同じプロンプト・シード・Steps・CFG・サンプラー・サイズ・モデルの画像があれば生成しません")
+        monitor_layout.addWidget(self.chk_skip_existing, 2, 0, 1, 4)
         bottom_layout.addWidget(monitor_group)
         #bottom_splitter.addWidget(monitor_group)        
 
         self.splitter.setSizes([300, 600])
 
+        self.txt_prompt.textChanged.connect(self.update_combination_count)
+        self.edit_steps.textChanged.connect(self.update_combination_count)
+        self.update_combination_count()
+
         # 各UI要素の変更を検知する
         self.txt_prompt.textChanged.connect(self.on_ui_parameter_changed)
         self.txt_neg_prompt.textChanged.connect(self.on_ui_parameter_changed)
@@ -1200,11 +1994,11 @@ class ForgeClientPanel(QWidget):
         if d := QFileDialog.getExistingDirectory(self, "保存先フォルダの選択", self.edit_out_dir.text()):
             self.edit_out_dir.setText(os.path.normpath(d))
 
-    def load_models(self):
+    def load_models(self, retries: int | None = None):
         self.lbl_status.setText("🔄 モデル一覧を取得中...")
         QApplication.processEvents()
         try:
-            res = requests.get(f"{FORGE_URL}/sdapi/v1/sd-models", timeout=3); res.raise_for_status(); models = res.json()
+            models = FORGE_CLIENT.sd_models(retries)
             self.combo_model.clear()
             for m in models: self.combo_model.addItem(m["title"], m["model_name"])
             self.lbl_status.setText(f"✨ {len(models)} 個のモデルをロード")
@@ -1292,7 +2086,8 @@ class ForgeClientPanel(QWidget):
         self.thread = GenerationThread(
             tasks, self.spin_interval.value(), self.spin_temp.value(), 
             target_model, self.edit_out_dir.text().strip(), 
-            self.chk_forever.isChecked(), self.chk_fixed_seed.isChecked()
+            self.chk_forever.isChecked(), self.chk_fixed_seed.isChecked(),
+            skip_existing=self.chk_skip_existing.isChecked()
         )
         self.thread.status_updated.connect(self.lbl_status.setText)
         self.thread.image_generated.connect(self.on_image_generated)
@@ -1300,7 +2095,12 @@ class ForgeClientPanel(QWidget):
         self.thread.finished_all.connect(self.on_generation_finished)
         self.thread.start()
         self.thread.generation_started.connect(self.on_generation_started)
-        self.progress_timer.start(1000)
+
+    def update_combination_count(self):
+        """生成を始める前に、プロンプトの展開と Steps の組み合わせ件数を表示する"""
+        steps_list = [int(s.strip()) for s in self.edit_steps.text().strip().split(',') if s.strip().isdigit()] or [20]
+        tasks = create_generation_tasks({"prompt": self.txt_prompt.toPlainText(), "seed": 0}, steps_list, 1, True)
+        self.lbl_combinations.setText(f"組み合わせ: {len(tasks):,} 件 (プロンプト {tasks.prompt_count:,} × Steps {len(steps_list)})")
 
     def apply_parameters_to_loop(self):
         """スレッドへ次回のループに適用するパラメータを渡す"""
@@ -1339,16 +2139,14 @@ class ForgeClientPanel(QWidget):
         else:
             QMessageBox.information(self, "通知", "プレビュー画像がありません。")
 
-    def check_forge_progress(self):
-        try:
-            res = requests.get(f"{FORGE_URL}/sdapi/v1/progress", timeout=1)
-            if res.status_code == 200:
-                progress_val = res.json().get("progress", 0.0)
-                step_val = int((progress_val * 100) // 20) * 20
-                if step_val < self.progress_bar.value():
-                    step_val = self.progress_bar.value()
-                self.progress_bar.setValue(step_val)
-        except Exception: pass
+    def on_forge_progress(self, progress_val: float):
+        if not (self.thread and self.thread.isRunning()): return
+        step_val = int((progress_val * 100) // 20) * 20
+        if step_val < self.progress_bar.value():
+            step_val = self.progress_bar.value()
+        self.progress_bar.setValue(step_val)
+        self.progress_bar.setToolTip("\n".join(f"{name}: {m['count']} 回 (失敗 {m['errors']} / 再試行 {m['retries']}) p50 {m['p50_ms']} ms / p95 {m['p95_ms']} ms"
+                                               for name, m in FORGE_CLIENT.metrics().items()))
 
     def on_ui_parameter_changed(self):  
         """UIの値が変更された時に呼ばれる"""
@@ -1366,9 +2164,10 @@ class ForgeClientPanel(QWidget):
     def on_generation_error(self, err_msg: str): QMessageBox.critical(self, "生成エラー", err_msg); self.on_generation_finished()
 
     def on_generation_finished(self):
-        self.progress_timer.stop()
         self.progress_bar.setValue(100)
-        self.lbl_status.setText("✨ 生成完了")
+        skipped = self.thread.skipped_count if self.thread else 0
+        thermal_log = self.thread.thermal_log_path if self.thread else None
+        self.lbl_status.setText(("✨ 生成完了" + (f" (生成済み {skipped} 件をスキップ)" if skipped else "")) + (f" | 温度ログ: {thermal_log}" if thermal_log else ""))
         self.btn_start.setStyleSheet("background-color: #4CAF50; color: white; font-weight: bold; padding: 10px;")
         self.btn_start.setText("▶️ 生成スタート")
         self.btn_start.setEnabled(True) 
@@ -1439,6 +2238,9 @@ class ImageViewer(QMainWindow):
         self.tab_widget.addTab(self.c_view, "比較")
         self.tab_widget.currentChanged.connect(self.on_tab_changed)
 
+        self.rescale_timer = QTimer(self); self.rescale_timer.setSingleShot(True); self.rescale_timer.setInterval(RESCALE_DEBOUNCE_MS)
+        self.rescale_timer.timeout.connect(self.finish_rescale)
+
         self.views = [self.m_view, self.l_view, self.r_view]
         self.cp_tags = ["Prompt", "Negative prompt", "Steps", "Sampler", "CFG scale", "Seed", "Size", "Model", "VAE", "Denoising strength", "Variation seed", "Variation seed strength", "Clip skip"]
         for view in self.views:
@@ -1450,6 +2252,17 @@ class ImageViewer(QMainWindow):
         self.forge_panel.hide()
         self.forge_panel.close_requested.connect(self.close_forge_panel)
 
+        self.trace_overlay = TraceOverlay(self); self.trace_overlay.set_active(TRACER.enabled)
+        QShortcut(QKeySequence("Ctrl+Shift+T"), self).activated.connect(self.toggle_tracing)
+        QShortcut(QKeySequence("Ctrl+Shift+E"), self).activated.connect(self.export_trace)
+
+    def toggle_tracing(self): TRACER.enabled = not TRACER.enabled; self.trace_overlay.set_active(TRACER.enabled)
+    def export_trace(self):
+        if not TRACER.events: self.trace_overlay.show_message("トレースがありません (Ctrl+Shift+T で計測を開始)"); return
+        default_path = os.path.join(CACHE_DIR, f"trace-{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        if path := QFileDialog.getSaveFileName(self, "トレースの書き出し", default_path, "Chrome Trace (*.json)")[0]:
+            TRACER.export_chrome_trace(path); self.trace_overlay.show_message(f"書き出しました: {path}")
+
     def open_forge_panel_if_hidden(self):
         if self.forge_panel.isHidden():
 
@@ -1486,6 +2299,7 @@ class ImageViewer(QMainWindow):
         menu.exec(sender.mapToGlobal(pos))
     def send_and_move(self, source, target): self.send_to(source, target); self.tab_widget.setCurrentIndex(target)
 
+    @traced()
     def compare_metadata(self):
         if not self.l_view.current_image_path and not self.r_view.current_image_path:
             return
@@ -1528,21 +2342,9 @@ class ImageViewer(QMainWindow):
         right_highlight_on = self.r_view.chk_highlight.isChecked()
         any_highlight_on = left_highlight_on or right_highlight_on
 
-        # ★追加：左側の検索ワード抽出
-        l_highlight_word = ""
-        l_is_neg = False
-        if left_highlight_on:
-            l_query = self.l_view.text_box.text().strip()
-            l_is_neg = l_query.startswith("-")
-            l_highlight_word = l_query[1:].strip() if l_is_neg else l_query
-            
-        # ★追加：右側の検索ワード抽出
-        r_highlight_word = ""
-        r_is_neg = False
-        if right_highlight_on:
-            r_query = self.r_view.text_box.text().strip()
-            r_is_neg = r_query.startswith("-")
-            r_highlight_word = r_query[1:].strip() if r_is_neg else r_query
+        # ★追加：左右の検索クエリ抽出
+        l_query = self.l_view.filter_query() if left_highlight_on else None
+        r_query = self.r_view.filter_query() if right_highlight_on else None
 
         # 展開して可読性を高めた統合比較ループ
         for key in self.cp_tags:
@@ -1561,10 +2363,9 @@ class ImageViewer(QMainWindow):
                 # いずれかのハイライトがONの場合は差分比較を無効化する
                 if any_highlight_on:
                     # 左側のハイライトがONなら検索ワードを強調
-                    if left_highlight_on and l_highlight_word:
-                        target_key = "Negative prompt" if l_is_neg else "Prompt"
-                        if key == target_key:
-                            left_label.apply_highlight([l_highlight_word], "#ff99ff")
+                    if l_query:
+                        if key == l_query.target_key:
+                            left_label.apply_highlight(l_query.highlight_words, "#ff99ff")
                 else:
                     # 全てOFFなら通常の差分比較を行う
                     if key in self.cp_tags[0:2]:
@@ -1584,10 +2385,9 @@ class ImageViewer(QMainWindow):
                 # いずれかのハイライトがONの場合は差分比較を無効化する
                 if any_highlight_on:
                     # 右側のハイライトがONなら検索ワードを強調
-                    if right_highlight_on and r_highlight_word:
-                        target_key = "Negative prompt" if r_is_neg else "Prompt"
-                        if key == target_key:
-                            right_label.apply_highlight([r_highlight_word], "#ff99ff")
+                    if r_query:
+                        if key == r_query.target_key:
+                            right_label.apply_highlight(r_query.highlight_words, "#ff99ff")
                 else:
                     # 全てOFFなら通常の差分比較を行う
                     if key in self.cp_tags[0:2]:
@@ -1603,37 +2403,45 @@ class ImageViewer(QMainWindow):
 
     def send_to(self, source, target):
         self.views[target].current_folder, self.views[target].current_image_path, self.views[target].image_label.image_path = self.views[source].current_folder, self.views[source].current_image_path, self.views[source].current_image_path
+        self.views[target].open_button.set_library_mode(self.views[source].open_button.library_mode, reload=False)
         self.views[target].load_image(self.views[target].current_image_path); self.views[target].open_button.current_folder = self.views[source].current_folder; self.resize_image(target)
-    def resize_image(self, view_id):
-        view = self.views[view_id]
-        if os.path.isfile(view.current_image_path):
-            sizes = view.splitter.sizes(); img = QPixmap(view.current_image_path)
-            view.image_label.setPixmap(img.scaled(view.image_label.width(), sizes[0], Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
+    def set_scaled_pixmap(self, view, width, height, smooth=True):
+        if os.path.isfile(view.current_image_path): view.image_label.setPixmap(PIXMAP_CACHE.scaled(view.current_image_path, width, height, smooth))
         elif view.current_folder and view.current_image_path: view.clear_view_area("png file deleted")
+    @traced()
+    def resize_image(self, view_id, smooth=True):
+        view = self.views[view_id]; self.set_scaled_pixmap(view, view.image_label.width(), view.splitter.sizes()[0], smooth)
     def on_tab_changed(self, index):
         if index == 0: self.resize_image(self.m_view.set_id)
         elif index == 1: self.resize_image(self.l_view.set_id); self.resize_image(self.r_view.set_id); self.compare_metadata()
-    def update_images(self, set_id):
+    def update_images(self, set_id, smooth=False):
+        # スプリッタのドラッグ中は高速なプレビューだけ表示し、操作が止まってから高品質に縮小し直す
         if set_id == 1:
-            self.resize_image(1); sizes = self.l_view.splitter.sizes()
-            if os.path.isfile(self.r_view.current_image_path):
-                img2 = QPixmap(self.r_view.current_image_path); self.r_view.image_label.setPixmap(img2.scaled(self.l_view.image_label.width(), sizes[0], Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
-            elif self.r_view.current_folder and self.r_view.current_image_path: self.r_view.clear_view_area("png file deleted")
+            self.resize_image(1, smooth); sizes = self.l_view.splitter.sizes()
+            self.set_scaled_pixmap(self.r_view, self.l_view.image_label.width(), sizes[0], smooth)
             self.r_view.splitter.setSizes(sizes)
-        elif set_id in (0, 2): self.resize_image(set_id)
+        elif set_id in (0, 2): self.resize_image(set_id, smooth)
+        if not smooth: self.rescale_timer.start()
+    def finish_rescale(self):
+        if self.tab_widget.currentIndex() == 0: self.resize_image(self.m_view.set_id)
+        else: self.resize_image(self.l_view.set_id); self.resize_image(self.r_view.set_id)
     def create_collection(self):
         collection = CollectionWindow(self); collection.setGeometry(self.x() + int(self.width() / 2), 200, 700, 220); collection.setWindowTitle("Collection " + str(self.collection_idx)); collection.show()
         self.collection_idx += 1; self.collection_windows.append(collection)
     def remove_collection(self, collection):
         if collection in self.collection_windows: self.collection_windows.remove(collection)
     def resizeEvent(self, event):
-        if self.tab_widget.currentIndex() == 0: self.resize_image(self.m_view.set_id)
-        else: self.resize_image(self.l_view.set_id); self.resize_image(self.r_view.set_id)
+        if self.tab_widget.currentIndex() == 0: self.resize_image(self.m_view.set_id, smooth=False)
+        else: self.resize_image(self.l_view.set_id, smooth=False); self.resize_image(self.r_view.set_id, smooth=False)
+        self.rescale_timer.start()
         super().resizeEvent(event)
 
 
 if __name__ == '__main__':
     app = QApplication([])
+    if pyside_refcount_broken():
+        QMessageBox.critical(None, "PySide6 の不具合", f"PySide6 {PYSIDE6_VERSION} には、使っているうちに異常終了する不具合があります。\npip install \"{PYSIDE6_REQUIREMENT}\" で入れ直してください。")
+        sys.exit(1)
     app.setStyle("Fusion")
     viewer = ImageViewer()
     viewer.show()
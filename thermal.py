@@ -0,0 +1,78 @@
+"""生成の間隔を CPU 温度に合わせて自動で決めるスロットル (Qt に依存しない)
+
+1 回の生成で上がる温度と、待機中に下がる速さを直近の生成から学習し、次の生成で上がっても上限に収まる温度まで
+下がるのにかかる時間 (フィードフォワード) に、学習のずれを打ち消す PI 制御の補正を加えて、生成直後の温度 (1 サイクルの最高温度) が上限温度にちょうど収まる最短の待ち時間を選ぶ。
+時刻と温度は呼び出し側から渡すので、シミュレーションした温度センサで動作を検証できる (bench/thermal.py)。
+"""
+import csv
+
+THROTTLE_MAX_DELAY = 600.0  # 待ち時間の上限 (秒)
+THROTTLE_KP = 0.5           # 比例ゲイン (最高温度の超過 1℃ あたりに延ばす秒数)
+THROTTLE_KI = 0.1           # 積分ゲイン (1 サイクルごとに積み増す秒数 / ℃)
+THROTTLE_ALPHA = 0.3        # 発熱・放熱の学習値を更新する重み (指数移動平均)
+THROTTLE_MIN_COOLING = 0.01  # 放熱の速さの下限 (℃/秒。ゼロ割りと過大な待ち時間を防ぐ)
+THROTTLE_WINDOW = 10        # 処理速度 (枚/時) を平均するサイクル数
+LOG_COLUMNS = ["backend", "time", "next_delay_s", "waited_s", "temp_start", "temp_peak", "generation_s", "heat_per_image", "cooling_per_s", "feedforward_s", "integral_s", "images_per_hour"]
+
+
+class ThermalThrottle:
+    """next_delay() で生成直後の温度から次の待ち時間を決め、start_generation() で待機後の温度を渡す。これを生成ごとに繰り返す"""
+
+    def __init__(self, target_temp: float, min_delay: float = 0.0, max_delay: float = THROTTLE_MAX_DELAY, kp: float = THROTTLE_KP, ki: float = THROTTLE_KI, name: str = ""):
+        self.target_temp, self.min_delay, self.max_delay, self.kp, self.ki, self.name = target_temp, min_delay, max_delay, kp, ki, name
+        self.heat = self.cooling = None  # 学習値: 1 枚あたりの温度上昇 (℃)、待機中の温度低下の速さ (℃/秒)
+        self.integral, self.delay = 0.0, 0.0
+        self._delay_start = self._gen_start = None  # (時刻, 温度)
+        self._cycle_start, self._waited = None, 0.0
+        self._cycles, self.log = [], []  # 直近のサイクル (待機 + 生成) の実際の所要時間、制御ログ
+
+    @staticmethod
+    def _ema(old: float | None, new: float) -> float: return new if old is None else old + THROTTLE_ALPHA * (new - old)
+
+    def feedforward(self, temp: float) -> float:
+        """temp から「上限 - 1 枚分の温度上昇」まで、学習した速さで下がるのにかかる時間 (上限付近では 発熱 / 放熱 で釣り合う)"""
+        if self.heat is None or self.cooling is None: return 0.0
+        return max(0.0, temp - (self.target_temp - max(0.0, self.heat))) / max(self.cooling, THROTTLE_MIN_COOLING)
+
+    def next_delay(self, temp: float, now: float) -> float:
+        """生成が終わった時点 (temp, now) で呼び、次の生成までの待ち時間 (秒) を返す。temp が -1.0 (取得不可) なら最小の待ち時間"""
+        gen_seconds = None
+        if self._gen_start is not None:
+            gen_time, gen_temp = self._gen_start; gen_seconds = now - gen_time
+            if temp != -1.0 and gen_temp != -1.0: self.heat = self._ema(self.heat, temp - gen_temp)
+            if self._cycle_start is not None: self._cycles = (self._cycles + [now - self._cycle_start])[-THROTTLE_WINDOW:]
+        if temp == -1.0: self.delay = self.min_delay
+        else:
+            error = temp - self.target_temp; ff = self.feedforward(temp)
+            raw = ff + self.kp * error + self.integral
+            # アンチワインドアップ: 上下限に張り付いている方向へは積分しない
+            if not ((raw >= self.max_delay and error > 0) or (raw <= self.min_delay and error < 0)):
+                self.integral = min(self.max_delay, max(-self.max_delay, self.integral + self.ki * error))
+            self.delay = min(self.max_delay, max(self.min_delay, ff + self.kp * error + self.integral))
+        if gen_seconds is not None:
+            self.log.append({"backend": self.name, "time": round(now, 3), "next_delay_s": round(self.delay, 3), "waited_s": round(self._waited, 3), "temp_start": self._gen_start[1], "temp_peak": temp, "generation_s": round(gen_seconds, 3),
+                             "heat_per_image": _round(self.heat), "cooling_per_s": _round(self.cooling), "feedforward_s": round(self.feedforward(temp), 3),
+                             "integral_s": round(self.integral, 3), "images_per_hour": round(self.images_per_hour(), 1)})
+        self._delay_start, self._gen_start, self._cycle_start = (now, temp), None, now
+        return self.delay
+
+    def start_generation(self, temp: float, now: float):
+        """待機が終わり、生成を始める時点 (temp, now) で呼ぶ。待機中の温度低下から放熱の速さを学習する"""
+        if self._delay_start is not None:
+            delay_time, delay_temp = self._delay_start; waited = self._waited = now - delay_time
+            if waited >= 1.0 and temp != -1.0 and delay_temp != -1.0 and delay_temp > temp: self.cooling = self._ema(self.cooling, (delay_temp - temp) / waited)
+        self._gen_start, self._delay_start = (now, temp), None
+
+    def images_per_hour(self) -> float:
+        return 3600 * len(self._cycles) / sum(self._cycles) if self._cycles and sum(self._cycles) > 0 else 0.0
+
+
+
+def export_log(path: str, throttles: list[ThermalThrottle]):
+    """制御ログを 1 つの CSV に書き出す (複数の接続先の分は backend 列で区別する)"""
+    rows = sorted((row for throttle in throttles for row in throttle.log), key=lambda row: row["time"])
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=LOG_COLUMNS); writer.writeheader(); writer.writerows(rows)
+
+
+def _round(value: float | None) -> float | None: return None if value is None else round(value, 4)